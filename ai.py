@@ -1,52 +1,566 @@
 import random
+import time
 
-piece_weight = {'K': 0, 'Q': 10, 'R': 5, 'B': 3, 'N': 3, 'P': 1}    # material scoring
-CHECKMATE = 1000
+import book
+import tablebase
+import telemetry
+
+piece_weight = {'K': 0, 'Q': 10, 'R': 5, 'B': 3, 'N': 3, 'P': 1}    # rough piece values for move ordering
+CHECKMATE = 100000  # scores are in centipawns (engine.piece_values)
 STALEMATE = 0
-DEPTH = 3
+DRAW = 0            # repetition and fifty-move rule
+DEPTH = 3           # search depth when there is no time or node limit
+MAX_DEPTH = 64      # iterative deepening never goes past this
+TIME_LIMIT = None   # default seconds per move for negamax_helper, None = no limit
+NODE_LIMIT = None   # default nodes per move for negamax_helper, None = no limit
+CHECK_EVERY = 1024  # nodes between clock checks
+USE_QUIESCENCE = True   # resolve captures (and checks) at the leaves instead of scoring mid-exchange
+USE_BOOK = True     # play opening book moves (book.py) without searching
+USE_TABLEBASES = True   # exact scores from the endgame tablebases (tablebase.py) for positions with few pieces
+TABLEBASE_WIN = CHECKMATE // 2  # minus the plies to mate from the root, above any evaluation, below a mate found by search
+WORKERS = 1         # processes for negamax_helper, more than one splits the root moves over a pool (parallel.py)
+USE_NULL_MOVE = True    # null move pruning: if the position still fails high after passing, cut it without searching the moves
+NULL_MOVE_REDUCTION = 2 # the null move is searched this many plies shallower than a normal move
+NULL_MOVE_MIN_DEPTH = 3 # no null move closer to the leaves
+USE_LMR = True      # late move reductions: quiet moves late in the ordering are searched a ply shallower first
+LMR_MIN_DEPTH = 3   # no reductions closer to the leaves
+LMR_MIN_MOVES = 3   # moves searched at full depth before reducing
+USE_PVS = True      # principal variation search: moves after the first are only tried with a null window
+USE_ASPIRATION = True   # search each iteration in a window around the previous score first
+ASPIRATION_WINDOW = 50  # half width of that window in centipawns, widened on every fail
+MATE_SCORE = TABLEBASE_WIN - 128    # scores beyond this are forced mates (search or tablebase), not evaluations
+
+# filled in by every search
+nodes = 0           # nodes visited
+search_depth = 0    # depth of the last completed iteration
+search_score = 0    # its score, from the side to move's point of view
+principal_variation = []    # its expected line, best move first
+stats = None        # telemetry.SearchStats of the running search, None when telemetry is off (telemetry.py)
+
+# transposition table bound types
+EXACT = 0           # score is the exact minimax value
+LOWER_BOUND = 1     # search failed high (beta cutoff), real score is at least this
+UPPER_BOUND = 2     # search failed low, real score is at most this
+TT_SIZE = 1 << 18   # number of entries, must be a power of two
+
+''' fixed size transposition table, indexed by the low bits of GameState.zobrist_key
+    entries are tuples (key, depth, bound, score, best_move, age)
+    replacement policy: empty slots and entries left from an older search are always replaced,
+    otherwise the new entry only replaces one searched to the same depth or less
+'''
+class TranspositionTable():
+    def __init__(self, size=TT_SIZE):
+        self.mask = size - 1
+        self.table = [None] * size
+        self.age = 0
+
+    ''' call once per negamax_helper so entries of old searches can be replaced '''
+    def new_search(self):
+        self.age += 1
+
+    def clear(self):
+        self.table = [None] * len(self.table)
+
+    def probe(self, key):
+        entry = self.table[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, bound, score, best_move):
+        index = key & self.mask
+        entry = self.table[index]
+        if entry is None or entry[5] != self.age or depth >= entry[1]:
+            self.table[index] = (key, depth, bound, score, best_move, self.age)
+
+transposition_table = TranspositionTable()
+
+# move ordering, moves are sorted by these tiers, then by history score
+HASH_MOVE_SCORE = 1 << 30
+CAPTURE_SCORE = 1 << 29     # + most valuable victim / least valuable attacker
+KILLER_SCORE = 1 << 28
+HISTORY_LIMIT = 1 << 27     # history scores are halved when one gets this big
+MAX_PLY = 128
+MATE_IN_MAX = CHECKMATE - MAX_PLY   # a mate found by search scores CHECKMATE minus the plies to it from the root, so at least this
+
+killer_moves = [[None, None] for _ in range(MAX_PLY)]  # two quiet moves per ply that caused a beta cutoff
+history = {}    # (piece_moved, end_row, end_col) -> how often (weighted by depth) that quiet move caused a cutoff
+deadline = None     # perf_counter time at which the running search stops
+max_nodes = None    # node count at which the running search stops
+stop_event = None   # threading.Event, the running search stops as soon as it is set
+ponder_event = None # threading.Event of a ponder search, set at ponderhit, until then there is no time limit
+ponder_limit = None # the time limit of that ponder search, it runs from ponderhit on
+root_alpha = None   # parallel.py workers: multiprocessing.Value with the best root score found by any worker,
+                    # re-read at ply 1 so a move another worker has already beaten is cut early
+
+# triangular principal variation table: pv_table[ply][:pv_length[ply]] is the best line found from ply on,
+# a node that raises alpha puts its move in front of the line of the child it searched
+pv_table = [[None] * MAX_PLY for _ in range(MAX_PLY)]
+pv_length = [0] * MAX_PLY
+
+''' raised inside negamax when the time or node limit runs out (or the search is stopped), unwinds the unfinished iteration '''
+class SearchTimeout(Exception):
+    pass
 
 def find_random_move(valid_moves):
     return valid_moves[random.randint(0, len(valid_moves) - 1)] 
 
-''' returns global variable next_move i.e., make the first recursive call'''
-def negamax_helper(gs, valid_moves):
-    global next_move
+''' iterative deepening: search depth 1, 2, 3 ... until the time or node limit runs out
+    returns the best move of the last completed iteration (global next_move holds the current one)
+    with neither limit it searches exactly max_depth (DEPTH) plies
+    the first iteration always completes, so there is a move even with a tiny limit
+    stop: optional threading.Event to cancel the search from another thread, this one does not
+    wait for the first iteration, a search stopped that early returns None
+    workers: number of processes (default WORKERS), see parallel.py
+    on_iteration: optional function called after every completed iteration as
+    on_iteration(depth, score, nodes, seconds, principal variation as a list of moves)
+    ponder: optional threading.Event, time_limit then only starts when it is set (UCI ponderhit)
+    a position in the opening book is answered with a book move, search_depth stays 0
+'''
+def negamax_helper(gs, valid_moves, max_depth=None, time_limit=None, node_limit=None, stop=None, workers=None, on_iteration=None, ponder=None):
+    global next_move, nodes, search_depth, search_score, principal_variation, deadline, max_nodes, stop_event, stats
+    workers = WORKERS if workers is None else workers
+    time_limit = TIME_LIMIT if time_limit is None else time_limit
+    node_limit = NODE_LIMIT if node_limit is None else node_limit
+    if max_depth is None:
+        max_depth = DEPTH if time_limit is None and node_limit is None else MAX_DEPTH
     next_move = None
+    nodes = 0
+    search_depth = 0
+    search_score = 0
+    principal_variation = []
+    deadline = None
+    max_nodes = None
+    stop_event = stop
+    stats = telemetry.SearchStats() if telemetry.sink is not None else None
+    if len(valid_moves) == 0:
+        return None
+    if USE_BOOK:
+        next_move = book.probe(gs, valid_moves)
+        if next_move is not None:
+            emit_stats(gs, next_move, book=True)
+            return next_move
+    if workers > 1:
+        import parallel     # only loaded when asked for, it imports this module
+        best_move = parallel.negamax_helper(gs, valid_moves, workers, max_depth, time_limit, node_limit, stop, on_iteration, ponder)
+        emit_stats(gs, best_move)
+        return best_move
+
+    time_limit = start_ponder(ponder, time_limit)
     random.shuffle(valid_moves)
-    # alpha: start at lowest possible score
-    # beta:  highest possible scores
-    negamax(gs, valid_moves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.whites_turn else -1)
-    return next_move
+    transposition_table.new_search()
+    new_ordering_search()
+    start = time.perf_counter()
+    best_move = None
+    ply_count = len(gs.move_log)
+    turn = 1 if gs.whites_turn else -1
+    for depth in range(1, max_depth + 1):
+        # alpha: start at lowest possible score
+        # beta:  highest possible scores
+        # aspiration: the score rarely moves much from one iteration to the next, a narrow window cuts more,
+        # if the score falls outside it the window is widened on that side and the iteration searched again
+        alpha, beta = -CHECKMATE, CHECKMATE
+        window = ASPIRATION_WINDOW
+        if USE_ASPIRATION and depth > 1 and abs(search_score) < MATE_SCORE:
+            alpha, beta = search_score - window, search_score + window
+        try:
+            while True:
+                score = negamax(gs, valid_moves, depth, alpha, beta, turn)
+                if score <= alpha and alpha > -CHECKMATE:
+                    alpha = max(alpha - window, -CHECKMATE)
+                elif score >= beta and beta < CHECKMATE:
+                    beta = min(beta + window, CHECKMATE)
+                else:
+                    break
+                window *= 4
+                if stats is not None:
+                    stats.aspiration_researches += 1
+        except SearchTimeout:
+            while len(gs.move_log) > ply_count:    # unwind the moves of the aborted iteration
+                gs.undo_a_move()
+            break
+        best_move = next_move
+        search_depth = depth
+        search_score = score
+        principal_variation = get_pv(gs, pv_table[0][:pv_length[0]] or [best_move], depth)
+        if stats is not None:
+            stats.end_iteration(depth, score, nodes)
+        if on_iteration is not None:
+            on_iteration(depth, score, nodes, time.perf_counter() - start, principal_variation)
+
+        # limits only apply once there is a move to play
+        if time_limit is not None:
+            deadline = start + time_limit
+        check_ponderhit()
+        if node_limit is not None:
+            max_nodes = node_limit
+        if len(valid_moves) == 1 or abs(score) >= MATE_IN_MAX:  # mate found, nothing more to find
+            break
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+        if max_nodes is not None and nodes >= max_nodes:
+            break
+        if stop_event is not None and stop_event.is_set():
+            break
+        # next_move stays set, so negamax searches it first in the next iteration
+
+    next_move = best_move
+    emit_stats(gs, best_move)
+    return best_move
+
+''' telemetry: the record of the search that just ended goes to the sink '''
+def emit_stats(gs, move, book=False):
+    if stats is not None:
+        telemetry.emit(stats.record(gs, move, search_depth, search_score, nodes, principal_variation, book))
+
+''' principal variation: the moves of line, then the best moves stored in the transposition table, as long as they are legal
+    the line from the pv table stops early where a node was answered by the transposition table or the tablebases
+'''
+def get_pv(gs, line, max_length):
+    pv = []
+    move = line[0] if line else None
+    while move is not None and len(pv) < max_length and move in gs.get_valid_moves():
+        gs.make_a_move(move)
+        pv.append(move)
+        if len(pv) < len(line):
+            move = line[len(pv)]
+        else:
+            entry = transposition_table.probe(gs.zobrist_key)
+            move = entry[4] if entry is not None else None
+    for _ in pv:
+        gs.undo_a_move()
+    return pv
+
+''' forget killers, age the history so old searches count less '''
+def new_ordering_search():
+    for killers in killer_moves:
+        killers[0] = killers[1] = None
+    for key in history:
+        history[key] >>= 1
+
+''' sort moves so the ones most likely to cause a cutoff come first
+    hash move, captures by most valuable victim / least valuable attacker (promotions with them), killers, history
+'''
+def order_moves(valid_moves, hash_move, ply):
+    killers = killer_moves[ply] if ply < MAX_PLY else (None, None)
+
+    def move_score(move):
+        if hash_move is not None and move == hash_move:
+            return HASH_MOVE_SCORE
+        if move.piece_captured != '--' or move.pawn_promotion:
+            score = CAPTURE_SCORE - piece_weight[move.piece_moved[1]]
+            if move.piece_captured != '--':
+                score += 16 * piece_weight[move.piece_captured[1]]
+            if move.pawn_promotion:
+                score += 16 * piece_weight[move.promotion_piece]
+            return score
+        if move == killers[0] or move == killers[1]:
+            return KILLER_SCORE + (move == killers[0])
+        return history.get((move.piece_moved, move.end_row, move.end_col), 0)
+
+    valid_moves.sort(key=move_score, reverse=True)
+
+''' a quiet move caused a beta cutoff: remember it as a killer for this ply and bump its history score '''
+def update_ordering(move, depth, ply):
+    if ply < MAX_PLY:
+        killers = killer_moves[ply]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+    key = (move.piece_moved, move.end_row, move.end_col)
+    score = history.get(key, 0) + depth * depth
+    history[key] = score
+    if score >= HISTORY_LIMIT:
+        for key in history:
+            history[key] >>= 1
 
 ''' minmax using negamax / alpha beta pruning
     alpha: max 
     beta:  min
     at any time alpha > beta, break
+    valid_moves is None below the root, the moves are only generated if the transposition table can't answer
+    ply is the distance from the root
+    null_move: False right after a null move, two passes in a row would just search the same position shallower
+    a position that repeats one before it (in the game or the search) is a draw: if it was good for either side
+    they could repeat it again, so there is no need to search the cycle
+    so is a position 100 plies after the last capture or pawn move, unless it is checkmate, which comes first
 '''
-def negamax(gs, valid_moves, depth, alpha, beta, turn):
+def negamax(gs, valid_moves, depth, alpha, beta, turn, ply=0, null_move=True):
     global next_move
+    count_node()
+    pv_length[ply] = 0
+    if ply > 0 and (gs.is_repetition() or (gs.halfmove_clock >= 100 and not is_checkmate(gs))):
+        return DRAW
+    if ply > 0 and USE_TABLEBASES and gs.piece_count <= tablebase.MAX_PIECES:
+        score = score_tablebase(gs, ply)
+        if score is not None:
+            return score
+
+    key = gs.zobrist_key
+    alpha_original = alpha
+    hash_move = None
+    entry = transposition_table.probe(key)
+    if stats is not None:
+        stats.tt_probes += 1
+        stats.tt_hits += entry is not None
+    if entry is not None:
+        hash_move = entry[4]
+        if entry[1] >= depth and ply > 0:   # never cut at the root, next_move has to be set
+            score = score_from_table(entry[3], ply)
+            if entry[2] == LOWER_BOUND:
+                alpha = max(alpha, score)
+            elif entry[2] == UPPER_BOUND:
+                beta = min(beta, score)
+            if entry[2] == EXACT or alpha >= beta:
+                if stats is not None:
+                    stats.tt_cutoffs += 1
+                return score
+
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves() if stats is None else timed_valid_moves(gs)
+        in_check = gs.in_check  # the searches below overwrite gs.in_check
+    else:   # moves passed in (the root): gs.in_check is left from the last move generation, maybe of another position
+        in_check = gives_check(gs)
+    if len(valid_moves) == 0:   # checkmate or stalemate
+        return score_no_moves(gs, ply)
     if depth == 0:  # deepest depth, we will return and evaluate
+        if USE_QUIESCENCE:
+            return quiescence(gs, valid_moves, alpha, beta, turn, ply)
         return turn * score_board(gs)
-    
+
+    # null move pruning: let the opponent move twice, if we are still above beta a real move would be too
+    # not in check (passing would be illegal) and not with only pawns left, where passing is often
+    # better than any move (zugzwang) and the cut would be wrong
+    if (USE_NULL_MOVE and null_move and ply > 0 and depth >= NULL_MOVE_MIN_DEPTH and not in_check
+            and beta < MATE_SCORE and turn * score_board(gs) >= beta and has_pieces(gs)):
+        if stats is not None:
+            stats.null_moves += 1
+        gs.make_null_move()
+        ply_count = len(gs.move_log)
+        try:
+            score = -negamax(gs, None, max(depth - 1 - NULL_MOVE_REDUCTION, 0), -beta, -beta + 1, -turn, ply + 1, False)
+        except SearchTimeout:   # the null move isn't in the move log, unwind the moves after it here
+            while len(gs.move_log) > ply_count:
+                gs.undo_a_move()
+            gs.undo_null_move()
+            raise
+        gs.undo_null_move()
+        if score >= beta:
+            if stats is not None:
+                stats.null_move_cutoffs += 1
+            return beta     # a mate found after passing isn't real, don't pass the score on
+
+    # at the root the best move of the previous iteration goes first
+    if ply == 0 and next_move is not None:
+        hash_move = next_move
+    order_moves(valid_moves, hash_move, ply)
+    killers = killer_moves[ply] if ply < MAX_PLY else (None, None)
+
     max_score = -CHECKMATE
-    for move in valid_moves:
+    best_move = None
+    for number, move in enumerate(valid_moves):
         gs.make_a_move(move)
-        next_moves = gs.get_valid_moves()
-        score = -negamax(gs, next_moves, depth-1, -beta, -alpha, -turn)  # this line is crucial in negamax
+        if number == 0:
+            score = -negamax(gs, None, depth-1, -beta, -alpha, -turn, ply+1)  # this line is crucial in negamax
+        else:
+            # late move reductions: a quiet move this far down the ordering rarely beats alpha, try it a ply
+            # shallower first and only search it to full depth if it does
+            # checks are never reduced, they are how mating attacks start
+            reduction = 0
+            if (USE_LMR and number >= LMR_MIN_MOVES and depth >= LMR_MIN_DEPTH and not in_check
+                    and move.piece_captured == '--' and not move.pawn_promotion
+                    and move != killers[0] and move != killers[1] and not gives_check(gs)):
+                reduction = 1
+            # principal variation search: with good ordering the first move is the best one, the others
+            # only have to be shown worse, which a null window (alpha, alpha + 1) does with far fewer nodes
+            # a move that beats alpha after all is searched again with the full window for its real score
+            window_beta = alpha + 1 if USE_PVS else beta
+            score = -negamax(gs, None, depth-1-reduction, -window_beta, -alpha, -turn, ply+1)
+            if score > alpha and reduction:
+                if stats is not None:
+                    stats.lmr_researches += 1
+                score = -negamax(gs, None, depth-1, -window_beta, -alpha, -turn, ply+1)
+            if window_beta < beta and alpha < score < beta:
+                if stats is not None:
+                    stats.pvs_researches += 1
+                score = -negamax(gs, None, depth-1, -beta, -alpha, -turn, ply+1)
+        if score > alpha:   # new best line: this move followed by the child's line
+            length = pv_length[ply + 1]
+            line = pv_table[ply]
+            line[0] = move
+            line[1:length + 1] = pv_table[ply + 1][:length]
+            pv_length[ply] = length + 1
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
+            best_move = move
+            if ply == 0:
                 next_move = move
 
         gs.undo_a_move()    
         # pruning the tree 
         if max_score > alpha:
             alpha = max_score
+        if ply == 1 and root_alpha is not None:   # the window never gets empty, a cut needs max_score >= beta
+            beta = min(beta, max(-root_alpha.value, alpha_original + 1))
         if alpha >= beta:
+            if move.piece_captured == '--' and not move.pawn_promotion:
+                update_ordering(move, depth, ply)
+            if stats is not None:
+                stats.cutoffs += 1
+                stats.first_move_cutoffs += number == 0
             break
 
+    if max_score <= alpha_original:
+        bound = UPPER_BOUND
+    elif max_score >= beta:
+        bound = LOWER_BOUND
+    else:
+        bound = EXACT
+    transposition_table.store(key, depth, bound, score_to_table(max_score, ply), best_move)
+
+    return max_score
+
+''' True if the side to move is in check, without generating its moves (gs.in_check is only set by that) '''
+def gives_check(gs):
+    king_row, king_col = gs.white_king_location if gs.whites_turn else gs.black_king_location
+    return gs.square_under_attack(king_row, king_col)
+
+''' True if the side to move is checkmated, the moves are only generated when it is in check '''
+def is_checkmate(gs):
+    return gives_check(gs) and len(gs.get_valid_moves()) == 0
+
+''' True if the side to move has a piece other than pawns and the king (null move zugzwang guard) '''
+def has_pieces(gs):
+    color = 'w' if gs.whites_turn else 'b'
+    for row in gs.board:
+        for piece in row:
+            if piece[0] == color and piece[1] in 'NBRQ':
+                return True
+    return False
+
+''' quiescence search, called at the leaves of negamax
+    only captures and queen promotions are searched, until the position is quiet
+    stand pat: the side to move can always decline to capture, so the static score is a lower bound
+    in check there is no standing pat, every evasion is searched
+'''
+def quiescence(gs, valid_moves, alpha, beta, turn, ply):
+    count_node()
+    if stats is not None:
+        stats.quiescence_nodes += 1
+    if USE_TABLEBASES and gs.piece_count <= tablebase.MAX_PIECES:
+        score = score_tablebase(gs, ply)
+        if score is not None:
+            return score
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves() if stats is None else timed_valid_moves(gs)
+    if len(valid_moves) == 0:
+        return score_no_moves(gs, ply)
+    if ply >= MAX_PLY:
+        return turn * score_board(gs)
+
+    if gs.in_check:
+        max_score = -CHECKMATE
+        moves = valid_moves
+    else:
+        max_score = turn * score_board(gs)  # stand pat
+        if max_score >= beta:
+            return max_score
+        if max_score > alpha:
+            alpha = max_score
+        moves = [move for move in valid_moves if move.piece_captured != '--' or (move.pawn_promotion and move.promotion_piece == 'Q')]
+    order_moves(moves, None, ply)
+
+    for move in moves:
+        gs.make_a_move(move)
+        score = -quiescence(gs, None, -beta, -alpha, -turn, ply+1)
+        gs.undo_a_move()
+        if score > max_score:
+            max_score = score
+            if max_score > alpha:
+                alpha = max_score
+            if alpha >= beta:
+                break
+
     return max_score
 
+''' score of a position where the side to move has no moves: mated ply plies from the root, or stalemate
+    nearer mates score higher for the winner, so the search plays the shortest mate and the score tells how far it is
+'''
+def score_no_moves(gs, ply):
+    if stats is not None:
+        stats.evaluations += 1
+    return -(CHECKMATE - ply) if gs.checkmate else STALEMATE
+
+''' exact score of a tablebase position from the side to move's point of view, None if it is not in the tables
+    the plies to mate are counted from the root (ply is the distance to it), so the score tells the mate to the root
+    shorter wins score higher, longer losses score higher
+'''
+def score_tablebase(gs, ply):
+    result = tablebase.probe(gs)
+    if stats is not None:
+        stats.tablebase_probes += 1
+        stats.tablebase_hits += result is not None
+    if result is None:
+        return None
+    result, plies = result
+    if result == tablebase.LOSS_RESULT and plies == 0:  # mated, same score as the search gives
+        return -(CHECKMATE - ply)
+    return result * max(TABLEBASE_WIN - ply - plies, MATE_SCORE)
+
+''' mate scores (search and tablebase) count from the root, in the transposition table they count from the entry's position
+    (the same position can come up at another ply or in a later search)
+'''
+def score_to_table(score, ply):
+    if abs(score) >= MATE_SCORE:
+        return score + ply if score > 0 else score - ply
+    return score
+
+def score_from_table(score, ply):
+    if abs(score) >= MATE_SCORE:
+        return score - ply if score > 0 else score + ply
+    return score
+
+''' moves to mate of a score from the side to move's point of view, negative when it is getting mated,
+    None if the score is not a mate (search mates count from CHECKMATE, tablebase mates from TABLEBASE_WIN)
+'''
+def mate_in(score):
+    if abs(score) >= MATE_IN_MAX:
+        plies = CHECKMATE - abs(score)
+    elif abs(score) >= MATE_SCORE:
+        plies = TABLEBASE_WIN - abs(score)
+    else:
+        return None
+    return (plies + 1) // 2 if score > 0 else -((plies + 1) // 2)
+
+''' counts a node and stops the search (SearchTimeout) when the time or node limit is used up '''
+def count_node():
+    global nodes
+    nodes += 1
+    if nodes % CHECK_EVERY == 0:
+        if stop_event is not None and stop_event.is_set():
+            raise SearchTimeout()
+        if ponder_event is not None and search_depth > 0:   # the first iteration always completes
+            check_ponderhit()
+        if deadline is not None and time.perf_counter() >= deadline:
+            raise SearchTimeout()
+        if max_nodes is not None and nodes >= max_nodes:
+            raise SearchTimeout()
+
+''' ponder searches: time_limit is kept back until ponderhit, returns the limit to start with (None for a ponder search) '''
+def start_ponder(ponder, time_limit):
+    global ponder_event, ponder_limit
+    ponder_event = ponder
+    ponder_limit = time_limit if ponder is not None else None
+    return None if ponder is not None else time_limit
+
+''' the first time the ponder event is seen set, the kept back time limit starts running '''
+def check_ponderhit():
+    global ponder_event, deadline
+    if ponder_event is not None and ponder_event.is_set():
+        ponder_event = None
+        if ponder_limit is not None:
+            deadline = time.perf_counter() + ponder_limit
+
 ''' take the gamestate of the engine 
     ## ideas to check board positions
     1) how many valid moves each piece can make (more options)
@@ -60,6 +574,12 @@ def negamax(gs, valid_moves, depth, alpha, beta, turn):
     NOTES: positive score is good for white, negative is good for black
 '''
 def score_board(gs):
+    if stats is not None:
+        return timed_score_board(gs)
+    return evaluate(gs)
+
+''' score_board without the telemetry '''
+def evaluate(gs):
     if gs.checkmate:            # check gamestate for checkmate
         if gs.whites_turn:
             return -CHECKMATE   # black wins
@@ -67,13 +587,21 @@ def score_board(gs):
             return CHECKMATE    # white wins
     elif gs.stalemate:          # check gamestate for stalemate
         return STALEMATE
-    else:
-        score = 0
-        for row in gs.board:
-            for square in row:
-                if square[0] == 'w':
-                    score += piece_weight[square[1]]
-                elif square[0] == 'b': 
-                    score -= piece_weight[square[1]]
-
-    return score
\ No newline at end of file
+
+    # material and piece square totals are kept up to date by the gamestate, no board scan
+    return gs.material_score + gs.position_score
+
+''' telemetry versions of move generation and evaluation, they add up the calls and the time spent '''
+def timed_valid_moves(gs):
+    start = time.perf_counter()
+    valid_moves = gs.get_valid_moves()
+    stats.move_generation_seconds += time.perf_counter() - start
+    stats.move_generations += 1
+    return valid_moves
+
+def timed_score_board(gs):
+    start = time.perf_counter()
+    score = evaluate(gs)
+    stats.evaluation_seconds += time.perf_counter() - start
+    stats.evaluations += 1
+    return score
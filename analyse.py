@@ -0,0 +1,146 @@
+'''
+Batch position analysis
+streams an EPD (or FEN per line) file and searches every position with ai.negamax_helper,
+one JSON line per position is written as soon as it (and every position before it) is done
+positions are shared out over a process pool, at most a few per worker are in flight,
+so memory stays the same whatever the size of the input
+
+usage
+    python analyse.py positions.epd --depth 4
+    python analyse.py positions.epd --time 2 --workers 8 --output results.jsonl
+EPD operations bm (best move) and am (avoid move) are checked, id is copied to the output
+'''
+import argparse
+import collections
+import concurrent.futures
+import json
+import sys
+import time
+
+import ai
+import engine
+import pgn
+
+IN_FLIGHT = 4       # positions queued per worker
+
+''' (fen, operations) of an EPD line, a FEN line (with move counters) has no operations '''
+def parse_epd(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError('not an EPD line: ' + line)
+    rest = fields[4] if len(fields) > 4 else ''
+    if rest and rest.split(None, 2)[0].isdigit():     # FEN move counters
+        return ' '.join(fields[:4] + rest.split()[:2]), {}
+    operations = {}
+    for operation in rest.split(';'):
+        operation = operation.strip()
+        if operation:
+            opcode, _, operand = operation.partition(' ')
+            operations[opcode] = operand.strip().strip('"')
+    return ' '.join(fields[:4]), operations
+
+''' worker setup: no book moves, the point is to search '''
+def init_worker():
+    ai.USE_BOOK = False
+
+''' searches one EPD line, returns its result record '''
+def analyse_position(number, line, depth, time_limit):
+    record = {'line': number}
+    try:
+        fen, operations = parse_epd(line)
+        gs = engine.GameState(fen)
+    except (ValueError, KeyError, IndexError) as error:
+        record['error'] = str(error)
+        return record
+    if 'id' in operations:
+        record['id'] = operations['id']
+    record['fen'] = fen
+
+    try:
+        valid_moves = gs.get_valid_moves()
+        start = time.perf_counter()
+        move = ai.negamax_helper(gs, valid_moves, max_depth=depth, time_limit=time_limit)
+        seconds = time.perf_counter() - start
+    except Exception as error:     # one bad position should not take the whole file down
+        record['error'] = '%s: %s' % (type(error).__name__, error)
+        return record
+    record.update({
+        'move': move.get_uci_notation() if move is not None else None,
+        'score': ai.search_score,
+        'depth': ai.search_depth,
+        'nodes': ai.nodes,
+        'seconds': round(seconds, 4),
+    })
+    for opcode in ('bm', 'am'):
+        if opcode in operations:
+            try:
+                expected = [pgn.parse_san(gs, san, valid_moves) for san in operations[opcode].split()]
+            except ValueError as error:
+                record['error'] = str(error)
+                continue
+            found = move in expected
+            record[opcode] = operations[opcode]
+            record['solved'] = found if opcode == 'bm' else not found
+    return record
+
+''' yields (line number, line) for the non empty lines, reads one line at a time '''
+def read_lines(path):
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield number, line
+
+''' analyses every position of path, calls write(record) in input order, returns (positions, solved, with bm / am) '''
+def analyse_file(path, write, depth=None, time_limit=None, workers=1):
+    positions = solved = tested = 0
+    def done(record):
+        nonlocal positions, solved, tested
+        positions += 1
+        if 'solved' in record:
+            tested += 1
+            solved += record['solved']
+        write(record)
+
+    if workers <= 1:
+        init_worker()
+        for number, line in read_lines(path):
+            done(analyse_position(number, line, depth, time_limit))
+        return positions, solved, tested
+
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+        pending = collections.deque()
+        for number, line in read_lines(path):
+            pending.append(pool.submit(analyse_position, number, line, depth, time_limit))
+            while len(pending) >= workers * IN_FLIGHT:     # window full, wait for the oldest
+                done(pending.popleft().result())
+        while pending:
+            done(pending.popleft().result())
+    return positions, solved, tested
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='search every position of an EPD file')
+    parser.add_argument('epd')
+    parser.add_argument('--depth', type=int, help='search depth (default ai.DEPTH without --time)')
+    parser.add_argument('--time', type=float, help='seconds per position')
+    parser.add_argument('--workers', type=int, default=1, help='processes (default 1)')
+    parser.add_argument('--output', help='JSON lines file (default standard output)')
+    args = parser.parse_args(argv)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    def write(record):
+        out.write(json.dumps(record) + '\n')
+        out.flush()
+
+    start = time.perf_counter()
+    positions, solved, tested = analyse_file(args.epd, write, args.depth, args.time, args.workers)
+    if args.output:
+        out.close()
+    summary = str(positions) + ' positions in ' + str(round(time.perf_counter() - start, 2)) + 's'
+    if tested:
+        summary += ', ' + str(solved) + '/' + str(tested) + ' solved'
+    print(summary, file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
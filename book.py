@@ -0,0 +1,150 @@
+'''
+Opening book
+a sorted binary file of 16 byte records in the Polyglot layout (all big endian):
+    key u64, move u16, weight u16, learn u32
+the file is opened with mmap and searched by binary search, nothing is loaded into Python objects
+the keys are the Polyglot ones (polyglot.py), so standard Polyglot books work as well as books built here
+
+usage
+    python book.py build <pgn directory> [--output book.bin] [--plies 20] [--min-games 2]
+    python book.py probe [--fen "<fen>"] [--book book.bin]
+'''
+import argparse
+import mmap
+import os
+import random
+import struct
+import sys
+
+import engine
+import pgn
+import polyglot
+
+BOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'book.bin')
+ENTRY = struct.Struct('>QHHI')
+KEY = struct.Struct('>Q')
+PROMOTION_CODES = {'N': 1, 'B': 2, 'R': 3, 'Q': 4}
+
+''' Polyglot move encoding: to file, to rank, from file, from rank (3 bits each, rank 0 is rank 1), promotion piece
+    castling is written as the king taking its own rook
+'''
+def encode_move(move):
+    end_col = move.end_col
+    if move.castle:
+        end_col = 7 if move.end_col == 6 else 0
+    code = end_col | (7 - move.end_row) << 3 | move.start_col << 6 | (7 - move.start_row) << 9
+    if move.pawn_promotion:
+        code |= PROMOTION_CODES[move.promotion_piece] << 12
+    return code
+
+class OpeningBook():
+    def __init__(self, path=BOOK_FILE):
+        self.file = open(path, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.size = size // ENTRY.size
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else None
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+        self.file.close()
+
+    ''' index of the first record with a key >= key '''
+    def lower_bound(self, key):
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    ''' list of (move code, weight) for a position key '''
+    def entries(self, key):
+        entries = []
+        index = self.lower_bound(key)
+        while index < self.size:
+            entry_key, code, weight, learn = ENTRY.unpack_from(self.data, index * ENTRY.size)
+            if entry_key != key:
+                break
+            entries.append((code, weight))
+            index += 1
+        return entries
+
+    ''' a book move for gs picked at random by weight, None if the position is not in the book '''
+    def get_move(self, gs, valid_moves):
+        weights = dict(self.entries(polyglot.polyglot_key(gs)))
+        moves = [move for move in valid_moves if weights.get(encode_move(move), 0) > 0]
+        if not moves:
+            return None
+        return random.choices(moves, [weights[encode_move(move)] for move in moves])[0]
+
+book = None         # opened on the first probe, False if there is no book file
+
+''' the book move for gs, None if there is none (or no book) '''
+def probe(gs, valid_moves):
+    global book
+    if book is None:
+        book = OpeningBook(BOOK_FILE) if os.path.exists(BOOK_FILE) else False
+    if not book:
+        return None
+    return book.get_move(gs, valid_moves)
+
+''' replays the first plies of every game in the PGN files of pgn_dir and writes the book
+    the weight of a move is the number of games it was played in, moves played in fewer than min_games are left out
+    returns the number of records written
+'''
+def build_book(pgn_dir, path=BOOK_FILE, plies=20, min_games=1):
+    counts = {}
+    for name in sorted(os.listdir(pgn_dir)):
+        if not name.lower().endswith('.pgn'):
+            continue
+        for headers, moves in pgn.read_games(os.path.join(pgn_dir, name)):
+            gs = engine.GameState()
+            if 'FEN' in headers:
+                continue    # book lines start from the start position
+            for san in moves[:plies]:
+                try:
+                    move = pgn.parse_san(gs, san)
+                except ValueError:
+                    break   # the rest of a broken game is skipped
+                entry = (polyglot.polyglot_key(gs), encode_move(move))
+                counts[entry] = counts.get(entry, 0) + 1
+                gs.make_a_move(move)
+
+    records = sorted((key, code, min(count, 0xFFFF)) for (key, code), count in counts.items() if count >= min_games)
+    with open(path, 'wb') as f:
+        for key, code, weight in records:
+            f.write(ENTRY.pack(key, code, weight, 0))
+    return len(records)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='build or probe the opening book')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='build the book from a directory of PGN files')
+    build.add_argument('pgn_dir')
+    build.add_argument('--output', default=BOOK_FILE)
+    build.add_argument('--plies', type=int, default=20, help='book depth in plies (default 20)')
+    build.add_argument('--min-games', type=int, default=1, help='leave out moves played in fewer games')
+    probe_parser = commands.add_parser('probe', help='list the book moves of a position')
+    probe_parser.add_argument('--fen', default=engine.START_FEN)
+    probe_parser.add_argument('--book', default=BOOK_FILE)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        print(str(build_book(args.pgn_dir, args.output, args.plies, args.min_games)) + ' records written to ' + args.output)
+        return 0
+
+    gs = engine.GameState()
+    gs.load_fen(args.fen)
+    opening_book = OpeningBook(args.book)
+    weights = dict(opening_book.entries(polyglot.polyglot_key(gs)))
+    for move in gs.get_valid_moves():
+        if encode_move(move) in weights:
+            print(move.get_uci_notation() + ': ' + str(weights[encode_move(move)]))
+    opening_book.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
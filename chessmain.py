@@ -2,6 +2,9 @@
 Driver file
 responsible for handling user input and displaying game state
 '''
+import copy
+import queue
+import threading
 import pygame as p
 import engine
 import ai
@@ -15,6 +18,7 @@ DIMENSION = 8
 SQ_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15
 IMAGES = {}
+AI_TIME_LIMIT = 1.0     # seconds the AI may think per move
 
 '''
 load images one time
@@ -53,6 +57,9 @@ def main():
     player_one = True   # True if human is playing, else False
     player_two = True   # True if human is playing, else False
 
+    # AI searches in a background thread, so the window keeps handling events while it thinks
+    ai_worker = None    # (thread, stop event, move queue, position) of the running search
+
     # movelog font 
     move_log_font = p.font.SysFont('Arial', 12, False, False)
     while running:
@@ -60,8 +67,14 @@ def main():
 
         for e in p.event.get():
             if e.type == p.QUIT:
+                ai_worker = cancel_ai_search(ai_worker)
                 running = False
 
+            # mouse wheel over the move log scrolls it
+            elif e.type == p.MOUSEWHEEL:
+                if p.mouse.get_pos()[0] >= BOARD_WIDTH:
+                    scroll_move_log(-e.y, move_log_font)
+
             # Mouse Event Handler
             elif(e.type == p.MOUSEBUTTONDOWN):
                 # if not gameover:                   
@@ -103,13 +116,16 @@ def main():
             elif(e.type == p.KEYDOWN):
                 # undo move, when z is pressed
                 if e.key == p.K_z:
+                    ai_worker = cancel_ai_search(ai_worker)
                     gs.undo_a_move()
                     move_made = True
                     animate = False
                     gameover = False
+                    invalidate()    # takes the game over text off
 
                 # reset board, when r is pressed
                 if e.key == p.K_r:
+                    ai_worker = cancel_ai_search(ai_worker)
                     gs = engine.GameState()
                     valid_moves = gs.get_valid_moves()
                     sq_selected = ()    # deselect
@@ -117,15 +133,24 @@ def main():
                     move_made = False
                     animate = False
                     gameover = False
+                    invalidate()
 
         # AI move Generation
-        if not gameover and not human_turn:
-            ai_move = ai.negamax_helper(gs, valid_moves)
-            if ai_move == None:
-                ai_move = ai.find_random_move(valid_moves)      # Implement this Asynchronously
-            gs.make_a_move(ai_move)
-            move_made = True
-            animate = True
+        # not in a frame where the position changed (move, undo, reset): valid_moves is only rebuilt below
+        human_turn = (gs.whites_turn and player_one) or (not gs.whites_turn and player_two)
+        if running and not gameover and not human_turn and not move_made:
+            if ai_worker is None:
+                ai_worker = start_ai_search(gs, valid_moves)
+            try:
+                ai_move = ai_worker[2].get_nowait()
+            except queue.Empty:
+                ai_move = None      # still thinking, keep drawing
+            if ai_move != None:
+                if ai_worker[3] == search_position(gs):
+                    gs.make_a_move(ai_move)
+                    move_made = True
+                    animate = True
+                ai_worker = None    # a move searched for another position is dropped, the next frame searches again
 
         if move_made:
             if animate:
@@ -134,67 +159,168 @@ def main():
             move_made = False
             animate = False
 
-        draw_gamestate(screen, gs, valid_moves, sq_selected, move_log_font) 
+        rects = draw_gamestate(screen, gs, valid_moves, sq_selected, move_log_font) 
 
-        if gs.checkmate or gs.stalemate:
+        result = game_result(gs)
+        if result is not None:
+            if not gameover or rects:   # text goes over the board, draw it again when squares under it were drawn
+                draw_text(screen, result)
+                rects.append(p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT))
             gameover = True
-            draw_text(screen, 'draw' if gs.stalemate else 'black wins by checkmate' if gs.whites_turn else 'white wins by checkmate')
 
+        if rects:
+            p.display.update(rects)     # nothing to do on idle frames
         clock.tick(MAX_FPS)
-        p.display.flip()
+
+''' text for the end of the game, None while the game goes on '''
+def game_result(gs):
+    if gs.checkmate:
+        return 'black wins by checkmate' if gs.whites_turn else 'white wins by checkmate'
+    if gs.stalemate:
+        return 'draw'
+    if gs.is_repetition(2):
+        return 'draw by threefold repetition'
+    if gs.halfmove_clock >= 100:
+        return 'draw by fifty-move rule'
+    return None
 
 '''
-draws squares and pieces
+start the AI search in a worker thread, on a copy of the gamestate so the board being drawn never changes
+returns (thread, stop event, move queue, position), the move is put on the queue when the search is done
+position (search_position) tells which position the move is for
 '''
-def draw_gamestate(screen, gs, valid_moves, sq_selected, font):
-    draw_board(screen)
-    draw_highlight(screen, gs, valid_moves, sq_selected)
-    highlight_last_move(screen, gs)
-    draw_pieces(screen, gs.board)
-    draw_move_log(screen, gs, font)
+def start_ai_search(gs, valid_moves):
+    stop = threading.Event()
+    move_queue = queue.Queue()
+    thread = threading.Thread(target=ai_search, args=(copy.deepcopy(gs), list(valid_moves), stop, move_queue), daemon=True)
+    thread.start()
+    return thread, stop, move_queue, search_position(gs)
+
+''' tag of a position for the AI worker: zobrist key and ply, the same position reached later is another search '''
+def search_position(gs):
+    return gs.zobrist_key, len(gs.move_log)
+
+def ai_search(gs, valid_moves, stop, move_queue):
+    ai_move = ai.negamax_helper(gs, valid_moves, time_limit=AI_TIME_LIMIT, stop=stop)
+    if ai.principal_variation and not stop.is_set():
+        # expected line
+        print('depth ' + str(ai.search_depth) + ' score ' + str(ai.search_score) + ': ' +
+              ' '.join(move.get_chess_notation() for move in ai.principal_variation))
+    if ai_move == None:
+        ai_move = ai.find_random_move(valid_moves)
+    if not stop.is_set():
+        move_queue.put(ai_move)
 
 '''
-draw the squares on the draw_board
-note: top left is always light
+stop a running AI search, e.g. on undo or reset
+waits for the thread (at most a few ms), so two searches never share the ai module state
 '''
-def draw_board(screen):
-    global colors   
-    colors = [p.Color('white'), p.Color('grey')]
+def cancel_ai_search(ai_worker):
+    if ai_worker is not None:
+        thread, stop = ai_worker[:2]
+        stop.set()
+        thread.join()
+    return None
+
+'''
+what is on the screen, so a frame only redraws the squares that changed
+squares: 8x8 of (piece, highlights) as last drawn, move_log: first line of the log as last drawn, None = draw everything
+'''
+drawn = {'squares': None, 'move_log': None}
+BOARD_SURFACE = []      # the square pattern, rendered once
+HIGHLIGHTS = {}         # color -> transparent square surface
+SELECTED_COLOR = (40, 255, 40)
+MOVE_COLOR = (80, 80, 255)
+LAST_MOVE_COLOR = (40, 255, 40)
+
+''' next draw_gamestate redraws the whole window, e.g. after an animation or text drawn over the board '''
+def invalidate():
+    drawn['squares'] = None
+    drawn['move_log'] = None
+
+'''
+draws squares and pieces, only where something changed since the last call
+returns the rects drawn, for p.display.update (empty on idle frames)
+'''
+def draw_gamestate(screen, gs, valid_moves, sq_selected, font):
+    rects = []
+    squares = square_states(gs, valid_moves, sq_selected)
+    full = drawn['squares'] is None
     for r in range(DIMENSION):
         for c in range(DIMENSION):
-            color = colors[((r+c)%2)]
-            p.draw.rect(screen, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+            if full or squares[r][c] != drawn['squares'][r][c]:
+                rects.append(draw_square(screen, r, c, *squares[r][c]))
+    drawn['squares'] = squares
+    if full:
+        rects = [p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT)]
+
+    changed = update_move_log(gs, font)
+    if changed or drawn['move_log'] != move_log_view['first']:
+        rects.append(draw_move_log(screen, gs, font))
+        drawn['move_log'] = move_log_view['first']
+    return rects
 
-''' 
-Highlight square selected, and show possible moves
 '''
-def draw_highlight(screen, gs, valid_moves, sq_selected):
+(piece, selected, move target, last move) for every square
+selected: square of the player's piece that was clicked, move target: where it can go
+'''
+def square_states(gs, valid_moves, sq_selected):
+    selected = targets = ()
     if sq_selected != ():   # square needs not be empty
         row, col = sq_selected
         if gs.board[row][col][0] == ('w' if gs.whites_turn else 'b'):   # check if piece can be moved
-            # highlighting selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100) # transparency: 0 = transparent, 255 = opaque
-            s.fill(p.Color(40, 255, 40))
-            screen.blit(s, (col*SQ_SIZE, row*SQ_SIZE))
-
-            s.fill(p.Color(80, 80, 255))
-            for move in valid_moves:
-                if move.start_row == row and move.start_col == col:
-                    screen.blit(s, (move.end_col*SQ_SIZE, move.end_row*SQ_SIZE))
+            selected = sq_selected
+            targets = {(move.end_row, move.end_col) for move in valid_moves if move.start_row == row and move.start_col == col}
+    last_move = ()
+    if len(gs.move_log) != 0:
+        move = gs.move_log[-1]
+        last_move = ((move.start_row, move.start_col), (move.end_row, move.end_col))
+    return [[(gs.board[r][c], (r, c) == selected, (r, c) in targets, (r, c) in last_move) for c in range(DIMENSION)]
+            for r in range(DIMENSION)]
+
+''' draws one square: background, highlights, piece, returns its rect '''
+def draw_square(screen, row, col, piece, selected, move_target, last_move):
+    square = p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    screen.blit(get_board_surface(), square, square)
+    if selected:
+        screen.blit(get_highlight(SELECTED_COLOR), square)
+    if move_target:
+        screen.blit(get_highlight(MOVE_COLOR), square)
+    if last_move:
+        screen.blit(get_highlight(LAST_MOVE_COLOR), square)
+    if piece != '--':
+        screen.blit(IMAGES[piece], square)
+    return square
 
 '''
-Highlights last move made
+the squares of the board, drawn once
+note: top left is always light
 '''
-def highlight_last_move(screen, gs):
-    # get the game log
-    if len(gs.move_log) != 0:
-        move = gs.move_log[-1]
+def get_board_surface():
+    if not BOARD_SURFACE:
+        colors = [p.Color('white'), p.Color('grey')]
+        surface = p.Surface((BOARD_WIDTH, BOARD_HEIGHT))
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                color = colors[((r+c)%2)]
+                p.draw.rect(surface, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
+        BOARD_SURFACE.append(surface)
+    return BOARD_SURFACE[0]
+
+''' transparent square of one color, made once per color '''
+def get_highlight(color):
+    if color not in HIGHLIGHTS:
         s = p.Surface((SQ_SIZE, SQ_SIZE))
-        s.set_alpha(100)
-        s.fill(p.Color(40, 255, 40))
-        screen.blit(s, (move.start_col*SQ_SIZE, move.start_row*SQ_SIZE))
-        screen.blit(s, (move.end_col*SQ_SIZE, move.end_row*SQ_SIZE))
+        s.set_alpha(100) # transparency: 0 = transparent, 255 = opaque
+        s.fill(p.Color(*color))
+        HIGHLIGHTS[color] = s
+    return HIGHLIGHTS[color]
+
+'''
+draw the squares on the draw_board
+'''
+def draw_board(screen):
+    screen.blit(get_board_surface(), (0, 0))
 
 '''
 draw pieces using current gamestate.board
@@ -206,68 +332,116 @@ def draw_pieces(screen, board):
             if piece != '--':
                 screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
-''' draws movelog '''
+'''
+move log panel state
+moves: the moves the lines were made for, lines: one rendered text surface per line (4 turns),
+first: index of the top visible line, follow: keep scrolled to the newest line
+'''
+move_log_view = {'moves': [], 'lines': [], 'first': 0, 'follow': True}
+LOG_PADDING = 5
+LOG_LINE_SPACING = 2
+MOVES_PER_ROW = 4   # turns per line
+
+''' notation of one line of the log: turns 4*line + 1 to 4*line + 4 '''
+def move_log_text(move_log, line):
+    text = ''
+    first_ply = line * MOVES_PER_ROW * 2
+    for i in range(first_ply, min(first_ply + MOVES_PER_ROW * 2, len(move_log)), 2):
+        turn_string = str(i//2 + 1) + '.' + str(move_log[i]) + ' '
+        # check if black piece has been moved
+        if i + 1 < len(move_log):
+            turn_string += str(move_log[i + 1])
+        text += turn_string + '  '
+    return text
+
+'''
+brings the cached lines up to date with gs.move_log, returns True if any line changed
+moves are only made and undone at the end, so this looks back from the end for the first ply that differs
+and renders the lines from there on again, normally just the last one
+'''
+def update_move_log(gs, font):
+    view = move_log_view
+    cached = view['moves']
+    move_log = gs.move_log
+    same = min(len(cached), len(move_log))
+    while same > 0 and cached[same - 1] is not move_log[same - 1]:
+        same -= 1
+    if same == len(cached) == len(move_log):
+        return False
+
+    view['moves'] = cached[:same] + move_log[same:]
+    first_line = same // (MOVES_PER_ROW * 2)
+    line_count = (len(move_log) + MOVES_PER_ROW * 2 - 1) // (MOVES_PER_ROW * 2)
+    del view['lines'][first_line:]
+    for line in range(first_line, line_count):
+        view['lines'].append(font.render(move_log_text(move_log, line), True, p.Color(255, 255, 255)))
+    if view['follow']:
+        view['first'] = max(0, line_count - visible_log_lines(font))
+    view['first'] = min(view['first'], max(0, line_count - 1))
+    return True
+
+''' number of lines that fit in the panel '''
+def visible_log_lines(font):
+    return (MOVE_LOG_PANEL_HEIGHT - LOG_PADDING) // (font.get_height() + LOG_LINE_SPACING)
+
+''' scrolls the log by lines (negative: up), follows the newest line again when scrolled to the bottom '''
+def scroll_move_log(lines, font):
+    view = move_log_view
+    bottom = max(0, len(view['lines']) - visible_log_lines(font))
+    view['first'] = min(max(view['first'] + lines, 0), bottom)
+    view['follow'] = view['first'] == bottom
+
+''' draws movelog, only the visible lines, returns the panel rect '''
 def draw_move_log(screen, gs, font):
     # side panel, start panel at where chess board ends
     movelog_panel = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
     p.draw.rect(screen, p.Color(0, 0, 0), movelog_panel)
 
-    # string manipulation for proper move log notation
-    move_log = gs.move_log
-    move_text = []
-    for i in range(0, len(move_log), 2):
-        turn_string = str(i//2 + 1) + '.' + str(move_log[i]) + ' '
-        # check if black piece has been moved
-        if i + 1 < len(move_log):
-            turn_string += str(move_log[i + 1])
-        move_text.append(turn_string)
-
-
-    padding = 5
-    text_y = padding
-    line_spacing = 2
-    moves_per_row = 4
-
-    for i in range(0, len(move_text), moves_per_row):
-        text = ''
-        for j in range(moves_per_row):
-            if i + j < len(move_text):
-                text += move_text[i+j] + '  '
- 
-        text_obj = font.render(text, True, p.Color(255, 255, 255))
-        text_loc = movelog_panel.move(padding, text_y)
-        text_y += text_obj.get_height() + line_spacing
+    view = move_log_view
+    text_y = LOG_PADDING
+    for text_obj in view['lines'][view['first']:view['first'] + visible_log_lines(font)]:
+        text_loc = movelog_panel.move(LOG_PADDING, text_y)
+        text_y += font.get_height() + LOG_LINE_SPACING
         screen.blit(text_obj, text_loc)
+    return movelog_panel
 
 
 ''' 
 Chess Piece Move Animation
+the board without the moving piece is drawn once, each frame only puts back the part of it
+the piece covered in the last frame and draws the piece at its new place
 '''
 def animate_move(move, screen, board, clock):
-    global colors
     drow = move.end_row - move.start_row
     dcol = move.end_col - move.start_col
 
+    draw_board(screen)
+    draw_pieces(screen, board)    
+    # erase the piece moved from it's ending square
+    end_square = p.Rect(move.end_col*SQ_SIZE, move.end_row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+    screen.blit(get_board_surface(), end_square, end_square)
+    # draw captured piece onto rectangle
+    if move.piece_captured != '--':
+        if move.enpassant:
+            enpassant_row = move.end_row + 1 if move.piece_captured[0] == 'b' else move.end_row - 1
+            end_square = p.Rect(move.end_col*SQ_SIZE, enpassant_row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        screen.blit(IMAGES[move.piece_captured], end_square)
+    background = screen.subsurface(p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT)).copy()
+    p.display.update(p.Rect(0, 0, BOARD_WIDTH, BOARD_HEIGHT))
+
     frames_per_square = 5  # frame to move one square
     frame_count = (abs(drow) + abs(dcol)) * frames_per_square
+    previous = None
     for frame in range(frame_count + 1):    
         row, col = (move.start_row + drow*frame/frame_count, move.start_col + dcol*frame/frame_count)
-        draw_board(screen)
-        draw_pieces(screen, board)    
-        # erase the piece moved from it's ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = p.Rect(move.end_col*SQ_SIZE, move.end_row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, end_square)
-        # draw captured piece onto rectangle
-        if move.piece_captured != '--':
-            if move.enpassant:
-                enpassant_row = move.end_row + 1 if move.piece_captured[0] == 'b' else move.end_row - 1
-                end_square = p.Rect(move.end_col*SQ_SIZE, enpassant_row*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-                screen.blit(IMAGES[move.piece_captured], end_square)
-            screen.blit(IMAGES[move.piece_captured], end_square)
-        screen.blit(IMAGES[move.piece_moved], p.Rect(col*SQ_SIZE, row*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
+        piece_rect = p.Rect(int(col*SQ_SIZE), int(row*SQ_SIZE), SQ_SIZE, SQ_SIZE)
+        if previous is not None:
+            screen.blit(background, previous, previous)
+        screen.blit(IMAGES[move.piece_moved], piece_rect)
+        p.display.update([previous, piece_rect] if previous is not None else [piece_rect])
+        previous = piece_rect
         clock.tick(60)
+    invalidate()    # the next frame draws the highlights again
 
 def draw_text(screen, text):
     font = p.font.SysFont('Sans', 32, True, False)
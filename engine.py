@@ -3,11 +3,134 @@ Responsible for storing all game state
 Responsible for move validation
 Stack for move logs
 '''
-from turtle import color
+import random
+
+'''
+Zobrist hashing
+one random 64-bit number per (piece, square), castling right, en passant file and for black to move
+a position's key is the XOR of the numbers of everything in it, so a move only has to XOR in/out what changed
+fixed seed so every run (and every process) gets the same keys
+'''
+zobrist_random = random.Random(2022)
+zobrist_pieces = {piece: [zobrist_random.getrandbits(64) for _ in range(64)]
+                  for piece in ('wP', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bP', 'bN', 'bB', 'bR', 'bQ', 'bK')}
+zobrist_castling = [zobrist_random.getrandbits(64) for _ in range(4)]   # wks, wqs, bks, bqs
+zobrist_enpassant = [zobrist_random.getrandbits(64) for _ in range(8)]  # one per file (column)
+zobrist_black_to_move = zobrist_random.getrandbits(64)
+
+'''
+castling rights: one bit per right, GameState.castling_rights is their sum
+a move takes away the rights of the squares it starts or ends on (king and rook squares),
+so after any move: castling_rights &= castling_masks[start] & castling_masks[end]
+'''
+WHITE_KING_SIDE = 1
+WHITE_QUEEN_SIDE = 2
+BLACK_KING_SIDE = 4
+BLACK_QUEEN_SIDE = 8
+ALL_CASTLING = 15
+castling_masks = [ALL_CASTLING] * 64
+castling_masks[7 * 8 + 4] = ALL_CASTLING ^ (WHITE_KING_SIDE | WHITE_QUEEN_SIDE)    # e1
+castling_masks[7 * 8 + 7] = ALL_CASTLING ^ WHITE_KING_SIDE     # h1
+castling_masks[7 * 8 + 0] = ALL_CASTLING ^ WHITE_QUEEN_SIDE    # a1
+castling_masks[0 * 8 + 4] = ALL_CASTLING ^ (BLACK_KING_SIDE | BLACK_QUEEN_SIDE)    # e8
+castling_masks[0 * 8 + 7] = ALL_CASTLING ^ BLACK_KING_SIDE     # h8
+castling_masks[0 * 8 + 0] = ALL_CASTLING ^ BLACK_QUEEN_SIDE    # a8
+# the pieces castling needs on their home squares, a right is dropped when its king or rook is missing
+castling_homes = ((7, 4, 'wK'), (7, 7, 'wR'), (7, 0, 'wR'), (0, 4, 'bK'), (0, 7, 'bR'), (0, 0, 'bR'))
+castling_letters = (('K', WHITE_KING_SIDE), ('Q', WHITE_QUEEN_SIDE), ('k', BLACK_KING_SIDE), ('q', BLACK_QUEEN_SIDE))
+# zobrist key of every combination of rights: XOR of the numbers of the rights in it
+zobrist_castling_keys = [0] * 16
+for rights in range(16):
+    for i in range(4):
+        if rights >> i & 1:
+            zobrist_castling_keys[rights] ^= zobrist_castling[i]
+
+# offsets shared by the move generators and the attack detection
+knight_offsets = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))    # 4 straight, then 4 diagonal
+
+# between_squares[a][b]: (row, col) of the squares strictly between square indexes a and b (row * 8 + col),
+# empty unless they share a row, column or diagonal
+between_squares = [[[] for _ in range(64)] for _ in range(64)]
+for start in range(64):
+    for d_row, d_col in directions:
+        row, col = start // 8 + d_row, start % 8 + d_col
+        path = []
+        while 0 <= row < 8 and 0 <= col < 8:
+            between_squares[start][row * 8 + col] = list(path)
+            path.append((row, col))
+            row += d_row
+            col += d_col
+
+'''
+evaluation terms, kept as running totals by make_a_move/undo_a_move (centipawns, positive is good for white)
+piece square tables are from white's point of view with row 0 the 8th rank, same as GameState.board,
+black pieces read them with the row mirrored
+'''
+piece_values = {'K': 0, 'Q': 900, 'R': 500, 'B': 330, 'N': 320, 'P': 100}
+piece_square_tables = {
+    'P': [  0,   0,   0,   0,   0,   0,   0,   0,
+           50,  50,  50,  50,  50,  50,  50,  50,
+           10,  10,  20,  30,  30,  20,  10,  10,
+            5,   5,  10,  25,  25,  10,   5,   5,
+            0,   0,   0,  20,  20,   0,   0,   0,
+            5,  -5, -10,   0,   0, -10,  -5,   5,
+            5,  10,  10, -20, -20,  10,  10,   5,
+            0,   0,   0,   0,   0,   0,   0,   0],
+    'N': [-50, -40, -30, -30, -30, -30, -40, -50,
+          -40, -20,   0,   0,   0,   0, -20, -40,
+          -30,   0,  10,  15,  15,  10,   0, -30,
+          -30,   5,  15,  20,  20,  15,   5, -30,
+          -30,   0,  15,  20,  20,  15,   0, -30,
+          -30,   5,  10,  15,  15,  10,   5, -30,
+          -40, -20,   0,   5,   5,   0, -20, -40,
+          -50, -40, -30, -30, -30, -30, -40, -50],
+    'B': [-20, -10, -10, -10, -10, -10, -10, -20,
+          -10,   0,   0,   0,   0,   0,   0, -10,
+          -10,   0,   5,  10,  10,   5,   0, -10,
+          -10,   5,   5,  10,  10,   5,   5, -10,
+          -10,   0,  10,  10,  10,  10,   0, -10,
+          -10,  10,  10,  10,  10,  10,  10, -10,
+          -10,   5,   0,   0,   0,   0,   5, -10,
+          -20, -10, -10, -10, -10, -10, -10, -20],
+    'R': [  0,   0,   0,   0,   0,   0,   0,   0,
+            5,  10,  10,  10,  10,  10,  10,   5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+           -5,   0,   0,   0,   0,   0,   0,  -5,
+            0,   0,   0,   5,   5,   0,   0,   0],
+    'Q': [-20, -10, -10,  -5,  -5, -10, -10, -20,
+          -10,   0,   0,   0,   0,   0,   0, -10,
+          -10,   0,   5,   5,   5,   5,   0, -10,
+           -5,   0,   5,   5,   5,   5,   0,  -5,
+            0,   0,   5,   5,   5,   5,   0,  -5,
+          -10,   5,   5,   5,   5,   5,   0, -10,
+          -10,   0,   5,   0,   0,   0,   0, -10,
+          -20, -10, -10,  -5,  -5, -10, -10, -20],
+    'K': [-30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -20, -30, -30, -40, -40, -30, -30, -20,
+          -10, -20, -20, -20, -20, -20, -20, -10,
+           20,  20,   0,   0,   0,   0,  20,  20,
+           20,  30,  10,   0,   0,  10,  30,  20],
+}
+# signed lookups used by the running totals, e.g. material_values['bQ'] == -900
+material_values = {color + piece: sign * value for color, sign in (('w', 1), ('b', -1)) for piece, value in piece_values.items()}
+position_values = {}
+for piece, table in piece_square_tables.items():
+    position_values['w' + piece] = list(table)
+    position_values['b' + piece] = [-table[(7 - sq // 8) * 8 + sq % 8] for sq in range(64)]
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
 
 
 class GameState():
-    def __init__(self):
+    ''' fen: start from this position instead of the initial one '''
+    def __init__(self, fen=None):
         # perhaps consider numpy, for efficiency
         self.board = [
             ['bR', 'bN', 'bB', 'bQ', 'bK', 'bB', 'bN', 'bR'],
@@ -38,19 +161,49 @@ class GameState():
         self.checks = []
 
         self.enpassant_possible = ()  # coordinations of the square where en passant capture is possible
-        self.enpassant_possible_log = [self.enpassant_possible]
-
-        self.castling_rights = CastlingRights(True, True, True, True)
-        self.castling_rights_log = [CastlingRights(self.castling_rights.white_king_side, self.castling_rights.white_queen_side, 
-                                                   self.castling_rights.black_king_side, self.castling_rights.black_queen_side)]
+        self.castling_rights = ALL_CASTLING     # bits, see castling_masks
 
         self.checkmate = False
         self.stalemate = False
 
+        self.zobrist_key = self.compute_zobrist_key()
+        self.material_score, self.position_score = self.compute_evaluation()
+        self.halfmove_clock = 0     # plies since the last capture or pawn move (fifty-move rule)
+        # one record per move made (and null move): what undo can't work out from the move itself,
+        # (castling rights, en passant square, zobrist key, material score, position score, halfmove clock) from before the move
+        # the keys are also the position history the repetitions are found in
+        self.undo_log = []
+        self.attack_maps = {}   # color -> (zobrist key, attack map), see get_attack_map
+        self.piece_count = 32   # pieces on the board, kings included (tablebases are probed by it)
+        self.start_ply = 0      # plies played before the position the game started from (FEN move number)
+        if fen is not None:
+            self.load_fen(fen)
+
     ''' make_a_move 
     does not work for pawn promotion, castling, en passant
     '''
     def make_a_move(self, move):
+        self.undo_log.append((self.castling_rights, self.enpassant_possible, self.zobrist_key, self.material_score, self.position_score,
+                              self.halfmove_clock))
+        if move.piece_moved[1] == 'P' or move.piece_captured != '--':
+            self.halfmove_clock = 0     # can't go back to an earlier position any more
+        else:
+            self.halfmove_clock += 1
+        # zobrist key: switch side, take out old castling rights / en passant file, they are put back at the end
+        key = self.zobrist_key ^ zobrist_black_to_move ^ zobrist_castling_keys[self.castling_rights]
+        if self.enpassant_possible != ():
+            key ^= zobrist_enpassant[self.enpassant_possible[1]]
+        key ^= zobrist_pieces[move.piece_moved][move.start_row * 8 + move.start_col]
+        # evaluation: piece leaves its square, captured piece leaves the board
+        material = self.material_score
+        position = self.position_score - position_values[move.piece_moved][move.start_row * 8 + move.start_col]
+        if move.piece_captured != '--':
+            capture_row = move.start_row if move.enpassant else move.end_row
+            key ^= zobrist_pieces[move.piece_captured][capture_row * 8 + move.end_col]
+            material -= material_values[move.piece_captured]
+            position -= position_values[move.piece_captured][capture_row * 8 + move.end_col]
+            self.piece_count -= 1
+
         self.board[move.end_row][move.end_col] = move.piece_moved   # if valid, piece moves to new board[row][col]
         self.board[move.start_row][move.start_col] = '--'           # if valid, piece at board[row][col] becomes '--'
         self.move_log.append(move)              # logging for backtracks
@@ -74,7 +227,7 @@ class GameState():
 
         # check for pawn promotion
         if move.pawn_promotion:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + 'Q' # make it a queen for now
+            self.board[move.end_row][move.end_col] = move.piece_moved[0] + move.promotion_piece
 
         # Castling
         if move.castle:
@@ -85,13 +238,31 @@ class GameState():
                 self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][move.end_col - 2] 
                 self.board[move.end_row][move.end_col - 2] = '--'                              
 
-        # update enpassant log
-        self.enpassant_possible_log.append(self.enpassant_possible)
+        # zobrist key and evaluation: piece on its new square (promoted piece if promotion), castled rook
+        placed = self.board[move.end_row][move.end_col]
+        key ^= zobrist_pieces[placed][move.end_row * 8 + move.end_col]
+        position += position_values[placed][move.end_row * 8 + move.end_col]
+        if move.pawn_promotion:
+            material += material_values[placed] - material_values[move.piece_moved]
+        if move.castle:
+            rook = move.piece_moved[0] + 'R'
+            if move.end_col - move.start_col == 2:
+                rook_from, rook_to = move.end_row * 8 + 7, move.end_row * 8 + 5
+            else:
+                rook_from, rook_to = move.end_row * 8, move.end_row * 8 + 3
+            key ^= zobrist_pieces[rook][rook_from] ^ zobrist_pieces[rook][rook_to]
+            position += position_values[rook][rook_to] - position_values[rook][rook_from]
+        self.material_score = material
+        self.position_score = position
 
-        # update castling rights
-        self.update_castling_rights(move)
-        self.castling_rights_log.append(CastlingRights(self.castling_rights.white_king_side, self.castling_rights.white_queen_side, 
-                                                   self.castling_rights.black_king_side, self.castling_rights.black_queen_side))
+        # update castling rights: king or rook moved, rook captured
+        self.castling_rights &= castling_masks[move.start_row * 8 + move.start_col] & castling_masks[move.end_row * 8 + move.end_col]
+
+        # zobrist key: new castling rights and en passant file
+        key ^= zobrist_castling_keys[self.castling_rights]
+        if self.enpassant_possible != ():
+            key ^= zobrist_enpassant[self.enpassant_possible[1]]
+        self.zobrist_key = key
 
     '''
     undo moves
@@ -114,13 +285,11 @@ class GameState():
                 self.board[move.end_row][move.end_col] = '--'   # leave where pawn ends up blank
                 self.board[move.start_row][move.end_col] = move.piece_captured
 
-            # reset enpassant rights
-            self.enpassant_possible_log.pop()
-            self.enpassant_possible = self.enpassant_possible_log[-1]
-
-            # reset castling rights
-            self.castling_rights_log.pop()
-            self.castling_rights = self.castling_rights_log[-1]
+            # reset castling rights, enpassant square, zobrist key and evaluation
+            (self.castling_rights, self.enpassant_possible, self.zobrist_key, self.material_score, self.position_score,
+             self.halfmove_clock) = self.undo_log.pop()
+            if move.piece_captured != '--':
+                self.piece_count += 1
 
             # undo castle
             if move.castle:
@@ -135,51 +304,165 @@ class GameState():
             self.checkmate = False
             self.stalemate = False
 
-    def update_castling_rights(self, move):
-        if move.piece_moved == 'wK':
-            self.castling_rights.white_king_side = False
-            self.castling_rights.white_queen_side = False
+    '''
+    null move: the side to move passes, used by the search (null move pruning)
+    only the side to move, en passant square and zobrist key change, the board and the move log stay as they are
+    must be undone with undo_null_move before any move made before it is undone
+    the halfmove clock starts again, a position after the pass is never a repetition of one before it
+    '''
+    def make_null_move(self):
+        self.undo_log.append((self.castling_rights, self.enpassant_possible, self.zobrist_key, self.material_score, self.position_score,
+                              self.halfmove_clock))
+        self.halfmove_clock = 0
+        key = self.zobrist_key ^ zobrist_black_to_move
+        if self.enpassant_possible != ():
+            key ^= zobrist_enpassant[self.enpassant_possible[1]]
+        self.enpassant_possible = ()
+        self.whites_turn = not self.whites_turn
+        self.zobrist_key = key
 
-        elif move.piece_moved == 'bK':
-            self.castling_rights.black_king_side = False
-            self.castling_rights.black_queen_side = False
-        
-        elif move.piece_moved == 'wR':
-            if move.start_col == 0: # left rook
-                self.castling_rights.white_queen_side = False
-            elif move.start_col == 7: # right rook
-                self.castling_rights.white_king_side = False
-
-        elif move.piece_moved == 'bR':
-            if move.start_col == 0: # left rook
-                self.castling_rights.black_queen_side = False
-            elif move.start_col == 7: # right rook
-                self.castling_rights.black_king_side = False
-
-        # if look is captured, update
-        if move.piece_captured == 'wR':
-            if move.end_row == 7: 
-                if move.end_col == 0: # left rook
-                    self.castling_rights.white_king_side = False
-                elif move.end_col == 7: # right rook 
-                    self.castling_rights.white_queen_side = False
-        elif move.piece_captured == 'bR':
-            if move.end_row == 0:
-                if move.end_col == 0: 
-                    self.castling_rights.black_king_side = False
-                elif move.end_col == 7: 
-                    self.castling_rights.black_queen_side = False
+    def undo_null_move(self):
+        (self.castling_rights, self.enpassant_possible, self.zobrist_key, self.material_score, self.position_score,
+         self.halfmove_clock) = self.undo_log.pop()
+        self.whites_turn = not self.whites_turn
+        self.checkmate = False
+        self.stalemate = False
+
+    '''
+    True if the position occurred count times before (with the same side to move, castling rights and en passant square)
+    count=2 is the threefold repetition draw, the search counts a single repetition as a draw
+    only the positions since the last capture or pawn move can repeat, and only every second one has the same side to move
+    '''
+    def is_repetition(self, count=1):
+        key = self.zobrist_key
+        undo_log = self.undo_log
+        last = len(undo_log)
+        seen = 0
+        for i in range(last - 2, max(last - self.halfmove_clock, 0) - 1, -2):
+            if undo_log[i][2] == key:   # zobrist key before move i
+                seen += 1
+                if seen >= count:
+                    return True
+        return False
+
+    '''
+    set up the position from a FEN string, the move log starts empty
+    uses piece placement, side to move, castling rights, en passant square, halfmove clock and move number,
+    the fields after the piece placement may be left out (EPD has no move counters),
+    castling rights whose king or rook is not on its home square are dropped
+    '''
+    def load_fen(self, fen):
+        fields = fen.split()
+        board = []
+        for rank in fields[0].split('/'):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(['--'] * int(char))
+                elif char.upper() in self.move_functions:
+                    row.append(('w' if char.isupper() else 'b') + char.upper())
+                else:
+                    raise ValueError('invalid piece in FEN: ' + fen)
+            board.append(row)
+        if len(board) != 8 or any(len(row) != 8 for row in board):
+            raise ValueError('FEN board must be 8x8: ' + fen)
+        kings = [piece for row in board for piece in row if piece[1] == 'K']
+        if sorted(kings) != ['bK', 'wK']:
+            raise ValueError('FEN needs exactly one king per side: ' + fen)
+        self.board = board
+
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == 'wK':
+                    self.white_king_location = (row, col)
+                elif board[row][col] == 'bK':
+                    self.black_king_location = (row, col)
+
+        self.whites_turn = len(fields) < 2 or fields[1] == 'w'
+        castling = fields[2] if len(fields) > 2 else '-'
+        self.castling_rights = sum(bit for letter, bit in castling_letters if letter in castling)
+        for row, col, piece in castling_homes:
+            if board[row][col] != piece:
+                self.castling_rights &= castling_masks[row * 8 + col]
+        enpassant = fields[3] if len(fields) > 3 else '-'
+        if enpassant == '-':
+            self.enpassant_possible = ()
+        else:
+            self.enpassant_possible = (Move.ranks_to_rows[enpassant[1]], Move.files_to_cols[enpassant[0]])
+
+        self.move_log = []
+        self.in_check = False
+        self.pins = []
+        self.checks = []
+        self.checkmate = False
+        self.stalemate = False
+        self.zobrist_key = self.compute_zobrist_key()
+        self.material_score, self.position_score = self.compute_evaluation()
+        self.undo_log = []
+        self.attack_maps = {}   # color -> (zobrist key, attack map), see get_attack_map
+        self.piece_count = sum(1 for row in board for piece in row if piece != '--')
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        fullmove = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        self.start_ply = 2 * (max(fullmove, 1) - 1) + (0 if self.whites_turn else 1)
+
+    '''
+    FEN string of the current position
+    '''
+    def get_fen(self):
+        rows = []
+        for row in self.board:
+            text = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += piece[1] if piece[0] == 'w' else piece[1].lower()
+            rows.append(text + (str(empty) if empty else ''))
+        castling = ''.join(letter for letter, bit in castling_letters if self.castling_rights & bit)
+        enpassant = '-' if self.enpassant_possible == () else Move.cols_to_files[self.enpassant_possible[1]] + Move.rows_to_ranks[self.enpassant_possible[0]]
+        fullmove = (self.start_ply + len(self.move_log)) // 2 + 1
+        return ' '.join(['/'.join(rows), 'w' if self.whites_turn else 'b', castling or '-', enpassant, str(self.halfmove_clock), str(fullmove)])
+
+    '''
+    zobrist key of the position, computed from scratch
+    make_a_move/undo_a_move keep self.zobrist_key up to date, this is for new positions (and checking)
+    '''
+    def compute_zobrist_key(self):
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != '--':
+                    key ^= zobrist_pieces[piece][row * 8 + col]
+        if not self.whites_turn:
+            key ^= zobrist_black_to_move
+        if self.enpassant_possible != ():
+            key ^= zobrist_enpassant[self.enpassant_possible[1]]
+        return key ^ zobrist_castling_keys[self.castling_rights]
+
+    '''
+    (material, piece square) totals of the position, computed from scratch
+    make_a_move/undo_a_move keep self.material_score and self.position_score up to date
+    '''
+    def compute_evaluation(self):
+        material = 0
+        position = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != '--':
+                    material += material_values[piece]
+                    position += position_values[piece][row * 8 + col]
+        return material, position
 
     '''
     Check for validity of player move
     '''
     def get_valid_moves(self):
-        # castling right check
-#        for log in self.castling_rights_log:
-#            print(log.white_king_side, log.white_queen_side, log.black_king_side, log.black_queen_side, end=', ')
-#        print()
-        temp_castle_rights = CastlingRights(self.castling_rights.white_king_side, self.castling_rights.white_queen_side, 
-                                            self.castling_rights.black_king_side, self.castling_rights.black_queen_side)        
         moves = []
         self.in_check, self.pins, self.checks = self.check_pins_and_checks()
         if self.whites_turn:
@@ -191,27 +474,8 @@ class GameState():
 
         if self.in_check:
             if len(self.checks) == 1:
-                moves = self.get_all_possible_moves()
-                # to block,
-                check = self.checks[0]
-                check_row = check[0]
-                check_col = check[1]
-                piece_check = self.board[check_row][check_col]
-                valid_sqaures = []  # squares which pieces other than king can move to block the check
-
-                if piece_check[1] == 'N':  # if the opposing check is given by knight, you must capture it
-                    valid_sqaures = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + check[2] * i, king_col + check[3] * i)
-                        valid_sqaures.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[1] == check_col:
-                            break
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].piece_moved[1] != 'K':
-                        if not (moves[i].end_row, moves[i].end_col) in valid_sqaures:
-                            moves.remove(moves[i])
-            else:
+                self.get_check_evasions(king_row, king_col, self.checks[0], moves)
+            else:   # double check, only the king can move
                 self.get_king_moves(king_row, king_col, moves)
 
         else:
@@ -231,10 +495,78 @@ class GameState():
             self.checkmate = False
             self.stalemate = False
 
-        self.castling_rights = temp_castle_rights
-
         return moves
 
+    '''
+    moves out of a single check, generated directly instead of filtering every pseudo-legal move:
+    king moves, captures of the checking piece, and moves onto the squares between it and the king
+    pinned pieces can never do either, so they are skipped
+    '''
+    def get_check_evasions(self, king_row, king_col, check, moves):
+        self.get_king_moves(king_row, king_col, moves)
+
+        ally = 'w' if self.whites_turn else 'b'
+        pinned = [(pin[0], pin[1]) for pin in self.pins]
+        check_row, check_col = check[0], check[1]
+        self.get_moves_to_square(check_row, check_col, ally, pinned, moves)
+        for row, col in between_squares[king_row * 8 + king_col][check_row * 8 + check_col]:
+            self.get_moves_to_square(row, col, ally, pinned, moves)
+
+        # a pawn that just moved two squares and gives check can also be taken en passant
+        if self.enpassant_possible != () and self.board[check_row][check_col][1] == 'P':
+            enpassant_row, enpassant_col = self.enpassant_possible
+            if check_col == enpassant_col and check_row == enpassant_row + (1 if self.whites_turn else -1):
+                enemy = 'b' if self.whites_turn else 'w'
+                for col in (check_col - 1, check_col + 1):
+                    if 0 <= col < 8 and self.board[check_row][col] == ally + 'P' and (check_row, col) not in pinned:
+                        if not self.enpassant_exposes_king(check_row, col, check_col, king_row, king_col, enemy):
+                            moves.append(Move((check_row, col), self.enpassant_possible, self.board, enpassant = True))
+
+    '''
+    add every move of ally's pieces (not the king, not pinned ones) that ends on row, col
+    reverse lookup from the target square, same idea as square_attacked_by
+    '''
+    def get_moves_to_square(self, row, col, ally, pinned, moves):
+        board = self.board
+        target = (row, col)
+        back_row = 0 if ally == 'w' else 7
+
+        # pawns: white pawns move up, so they come from the row below
+        pawn_row = row + 1 if ally == 'w' else row - 1
+        if 0 <= pawn_row < 8:
+            if board[row][col] != '--':     # capture
+                for pawn_col in (col - 1, col + 1):
+                    if 0 <= pawn_col < 8 and board[pawn_row][pawn_col] == ally + 'P' and (pawn_row, pawn_col) not in pinned:
+                        add_pawn_move(moves, (pawn_row, pawn_col), target, board, row == back_row)
+            elif board[pawn_row][col] == ally + 'P':
+                if (pawn_row, col) not in pinned:
+                    add_pawn_move(moves, (pawn_row, col), target, board, row == back_row)
+            elif board[pawn_row][col] == '--' and row == (4 if ally == 'w' else 3):    # two square move
+                start_row = pawn_row + 1 if ally == 'w' else pawn_row - 1
+                if board[start_row][col] == ally + 'P' and (start_row, col) not in pinned:
+                    moves.append(Move((start_row, col), target, board))
+
+        for d_row, d_col in knight_offsets:
+            start_row = row + d_row
+            start_col = col + d_col
+            if 0 <= start_row < 8 and 0 <= start_col < 8 and board[start_row][start_col] == ally + 'N':
+                if (start_row, start_col) not in pinned:
+                    moves.append(Move((start_row, start_col), target, board))
+
+        for j in range(len(directions)):
+            d = directions[j]
+            slider = 'R' if j < 4 else 'B'
+            start_row = row + d[0]
+            start_col = col + d[1]
+            while 0 <= start_row < 8 and 0 <= start_col < 8:
+                piece = board[start_row][start_col]
+                if piece != '--':
+                    if piece[0] == ally and (piece[1] == slider or piece[1] == 'Q') and (start_row, start_col) not in pinned:
+                        moves.append(Move((start_row, start_col), target, board))
+                    break
+                start_row += d[0]
+                start_col += d[1]
+
     '''maybe use greedy algorithm'''
     def get_all_possible_moves(self):
         moves = []
@@ -340,67 +672,50 @@ class GameState():
             king_row, king_col = self.black_king_location
 
         if self.board[row + move_amount][col] == '--':    # 1 square move
-            if not piece_pinned or pin_direction == (move_amount, 0):
+            if not piece_pinned or pin_direction == (move_amount, 0) or pin_direction == (-move_amount, 0): # along the pin, either way
                 if row + move_amount == back_row: #check promotion
                     pawn_promotion = True
-                moves.append(Move((row, col), (row+move_amount, col), self.board, pawn_promotion=pawn_promotion))
+                add_pawn_move(moves, (row, col), (row+move_amount, col), self.board, pawn_promotion)
                 if row == start_row and self.board[row+2*move_amount][col] == '--':
                     moves.append(Move((row, col), (row+2*move_amount, col), self.board))
 
         if col - 1 >= 0: # emulate capture to left
-            if not piece_pinned or pin_direction == (move_amount, -1):
+            if not piece_pinned or pin_direction == (move_amount, -1) or pin_direction == (-move_amount, 1):
                 if self.board[row + move_amount][col-1][0] == enemy_color:
                     if row + move_amount == back_row:
                         pawn_promotion = True
-                    moves.append(Move((row, col), (row + move_amount, col - 1), self.board, pawn_promotion=pawn_promotion))
+                    add_pawn_move(moves, (row, col), (row + move_amount, col - 1), self.board, pawn_promotion)
                 if (row + move_amount, col - 1) == self.enpassant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:   # check if king is left of the pawn
-                            inside_range = range(king_col + 1, col - 1) # go upto enemy pawn's column
-                            outside_range = range(col + 1, 8)
-                        else:
-                            inside_range = range(king_col - 1, col, -1)
-                            outside_range = range(col - 2, -1, -1)
-                        for i in inside_range:
-                            if self.board[row][i] != '--':  # something is blocking
-                                blocking_piece = True
-                        for i in outside_range:
-                            sq = self.board[row][i]
-                            if sq[0] == 'enemy_color' and (sq[1] =='R' or sq[1] == 'Q'):
-                                attacking_piece = True
-                            elif sq != '--':
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
+                    if not self.enpassant_exposes_king(row, col, col - 1, king_row, king_col, enemy_color):
                         moves.append(Move((row, col), (row + move_amount, col - 1), self.board, enpassant = True))
 
         if col + 1 <= 7: # emulate capture to right
-            if not piece_pinned or pin_direction == (move_amount, 1):
+            if not piece_pinned or pin_direction == (move_amount, 1) or pin_direction == (-move_amount, -1):
                 if self.board[row + move_amount][col+1][0] == enemy_color:
                     if row + move_amount == back_row:
                         pawn_promotion = True
-                    moves.append(Move((row, col), (row + move_amount, col + 1), self.board, pawn_promotion=pawn_promotion))
+                    add_pawn_move(moves, (row, col), (row + move_amount, col + 1), self.board, pawn_promotion)
                 if (row + move_amount, col + 1) == self.enpassant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:   # check if king is left of the pawn
-                            inside_range = range(king_col + 1, col) # go upto enemy pawn's column
-                            outside_range = range(col + 2, 8)
-                        else:
-                            inside_range = range(king_col - 1, col + 1, -1)
-                            outside_range = range(col - 1, -1, -1)
-                        for i in inside_range:
-                            if self.board[row][i] != '--':  # something is blocking
-                                blocking_piece = True
-                        for i in outside_range:
-                            sq = self.board[row][i]
-                            if sq[0] == 'enemy_color' and (sq[1] =='R' or sq[1] == 'Q'):
-                                attacking_piece = True
-                            elif sq != '--':
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
+                    if not self.enpassant_exposes_king(row, col, col + 1, king_row, king_col, enemy_color):
                         moves.append(Move((row, col), (row + move_amount, col + 1), self.board, enpassant = True))
 
+    '''
+    en passant takes two pawns off the same row at once, which can open a line to our own king
+    that the pin check can't see, so try it on the board and look at the king square
+    '''
+    def enpassant_exposes_king(self, row, col, capture_col, king_row, king_col, enemy_color):
+        end_row = self.enpassant_possible[0]
+        pawn = self.board[row][col]
+        captured = self.board[row][capture_col]
+        self.board[row][col] = '--'
+        self.board[row][capture_col] = '--'
+        self.board[end_row][capture_col] = pawn
+        exposed = self.square_attacked_by(king_row, king_col, enemy_color)
+        self.board[row][col] = pawn
+        self.board[row][capture_col] = captured
+        self.board[end_row][capture_col] = '--'
+        return exposed
+
     '''
     get all possible pawn moves for the pawn located at row and col, add to moves list
     '''
@@ -508,74 +823,159 @@ class GameState():
         row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
         col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
         ally_color = 'w' if self.whites_turn else 'b'
+        attacked = self.get_attack_map('b' if self.whites_turn else 'w')    # looks through our king
 
         for i in range(8):
             end_row = row + row_moves[i]
             end_col = col + col_moves[i]
             if 0 <= end_row < 8 and 0 <= end_col < 8:
                 end_piece = self.board[end_row][end_col]
+                if end_piece[0] != ally_color and not attacked[end_row][end_col]:
+                    moves.append(Move((row, col), (end_row, end_col), self.board))
 
-                if end_piece[0] != ally_color:
-                    # place king on end square, and check for checks
-                    if ally_color == 'w':
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
+    '''
+    is the square at row, col attacked by color's pieces
+    reverse lookup: looks outward from the square along the knight, pawn and king offsets and the eight rays,
+    instead of generating the opponent's moves
+    '''
+    def square_attacked_by(self, row, col, color):
+        board = self.board
+        for d_row, d_col in knight_offsets:
+            end_row = row + d_row
+            end_col = col + d_col
+            if 0 <= end_row < 8 and 0 <= end_col < 8 and board[end_row][end_col] == color + 'N':
+                return True
 
-                    in_check, pins, checks = self.check_pins_and_checks()
-                    if not in_check:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
+        pawn_row = row + 1 if color == 'w' else row - 1     # white pawns attack upwards, so they sit one row below
+        if 0 <= pawn_row < 8:
+            if col > 0 and board[pawn_row][col - 1] == color + 'P':
+                return True
+            if col < 7 and board[pawn_row][col + 1] == color + 'P':
+                return True
 
-                    if ally_color == 'w':
-                        self.white_king_location = (row, col)
-                    else:
-                        self.black_king_location = (row, col)
+        for j in range(len(directions)):
+            d = directions[j]
+            slider = 'R' if j < 4 else 'B'
+            end_row = row + d[0]
+            end_col = col + d[1]
+            distance = 1
+            while 0 <= end_row < 8 and 0 <= end_col < 8:
+                end_piece = board[end_row][end_col]
+                if end_piece != '--':
+                    if end_piece[0] == color and (end_piece[1] == slider or end_piece[1] == 'Q' or (distance == 1 and end_piece[1] == 'K')):
+                        return True
+                    break
+                end_row += d[0]
+                end_col += d[1]
+                distance += 1
+        return False
 
+    '''
+    is the square at row, col attacked by the side not to move
+    '''
     def square_under_attack(self, row, col):
-        self.whites_turn = not self.whites_turn
-        moves = self.get_all_possible_moves()   # get all opponents moves
-        self.whites_turn = not self.whites_turn
-        for move in moves:
-            if move.end_row == row and move.end_col == col:
-                return True
-        return False
+        return self.square_attacked_by(row, col, 'b' if self.whites_turn else 'w')
+
+    '''
+    attack map: 8x8 grid, True where color's pieces attack the square
+    sliders look through the other side's king, so the map also tells where that king must not step
+    worked out once per position (cached on the zobrist key) and shared by king moves and castling
+    '''
+    def get_attack_map(self, color):
+        cached = self.attack_maps.get(color)
+        if cached is not None and cached[0] == self.zobrist_key:
+            return cached[1]
+
+        board = self.board
+        enemy_king = ('b' if color == 'w' else 'w') + 'K'
+        attacked = [[False] * 8 for _ in range(8)]
+        for row in range(8):
+            for col in range(8):
+                piece = board[row][col]
+                if piece[0] != color:
+                    continue
+                kind = piece[1]
+                if kind == 'P':
+                    end_row = row - 1 if color == 'w' else row + 1
+                    if 0 <= end_row < 8:
+                        if col > 0:
+                            attacked[end_row][col - 1] = True
+                        if col < 7:
+                            attacked[end_row][col + 1] = True
+                elif kind == 'N' or kind == 'K':
+                    for d_row, d_col in (knight_offsets if kind == 'N' else directions):
+                        end_row = row + d_row
+                        end_col = col + d_col
+                        if 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacked[end_row][end_col] = True
+                else:
+                    first = 4 if kind == 'B' else 0
+                    last = 4 if kind == 'R' else 8
+                    for d_row, d_col in directions[first:last]:
+                        end_row = row + d_row
+                        end_col = col + d_col
+                        while 0 <= end_row < 8 and 0 <= end_col < 8:
+                            attacked[end_row][end_col] = True
+                            if board[end_row][end_col] != '--' and board[end_row][end_col] != enemy_king:
+                                break
+                            end_row += d_row
+                            end_col += d_col
+
+        self.attack_maps[color] = (self.zobrist_key, attacked)
+        return attacked
 
     def get_castling_moves(self, row, col, moves):
-        if self.square_under_attack(row, col):
+        if self.in_check:
+            return
+        ally = 'w' if self.whites_turn else 'b'
+        if (row, col) != ((7 if ally == 'w' else 0), 4):     # only from the king's home square, e1 / e8
             return
 
-        if (self.whites_turn and self.castling_rights.white_king_side) or (not self.whites_turn and self.castling_rights.black_king_side):
-            self.king_side_castle(row, col, moves)
+        attacked = self.get_attack_map('b' if self.whites_turn else 'w')
+        if self.castling_rights & (WHITE_KING_SIDE if self.whites_turn else BLACK_KING_SIDE):
+            self.king_side_castle(row, col, moves, attacked, ally + 'R')
 
-        if (self.whites_turn and self.castling_rights.white_queen_side) or (not self.whites_turn and self.castling_rights.black_queen_side):
-            self.queen_side_castle(row, col, moves)
+        if self.castling_rights & (WHITE_QUEEN_SIDE if self.whites_turn else BLACK_QUEEN_SIDE):
+            self.queen_side_castle(row, col, moves, attacked, ally + 'R')
 
-    def king_side_castle(self, row, col, moves):
-        if self.board[row][col + 1] == '--' and self.board[row][col + 2] == '--':
-            if not self.square_under_attack(row, col + 1) and not self.square_under_attack(row, col + 2):
+    ''' our own rook has to be on its corner, the squares between empty, and the squares the king passes not attacked '''
+    def king_side_castle(self, row, col, moves, attacked, rook):
+        if self.board[row][7] == rook and self.board[row][col + 1] == '--' and self.board[row][col + 2] == '--':
+            if not attacked[row][col + 1] and not attacked[row][col + 2]:
                 moves.append(Move((row, col), (row, col + 2), self.board, castle = True))
-        
-    def queen_side_castle(self, row, col, moves):
-        if self.board[row][col - 1] == '--' and self.board[row][col - 2] == '--' and self.board[row][col - 3] == '--':
-            if not self.square_under_attack(row, col - 1) and not self.square_under_attack(row, col - 2):
+
+    def queen_side_castle(self, row, col, moves, attacked, rook):
+        if self.board[row][0] == rook and self.board[row][col - 1] == '--' and self.board[row][col - 2] == '--' and self.board[row][col - 3] == '--':
+            if not attacked[row][col - 1] and not attacked[row][col - 2]:
                 moves.append(Move((row, col), (row, col - 2), self.board, castle = True))
 
 
-class CastlingRights():
-    def __init__(self, white_king_side, white_queen_side, black_king_side, black_queen_side):
-        self.white_king_side = white_king_side
-        self.white_queen_side = white_queen_side
-        self.black_king_side = black_king_side
-        self.black_queen_side = black_queen_side
+'''
+add a pawn move, or all four promotions if the pawn reaches the back row (queen first)
+'''
+def add_pawn_move(moves, start, end, board, pawn_promotion):
+    if pawn_promotion:
+        for piece in ('Q', 'R', 'B', 'N'):
+            moves.append(Move(start, end, board, pawn_promotion=True, promotion_piece=piece))
+    else:
+        moves.append(Move(start, end, board))
+
 
 class Move():
     # for each k, v in ranks to row, make a keypair {v1: k1, ..., vn:kn}
     ranks_to_rows = { '1': 7, '2': 6, '3': 5, '4': 4, '5': 3, '6': 2, '7': 1, '8': 0 } 
     rows_to_ranks = { v: k for k, v in ranks_to_rows.items() } 
-    files_to_cols = { 'a': 7, 'b': 6, 'c': 5, 'd': 4, 'e': 3, 'f': 2, 'g': 1, 'h': 0 }
+    files_to_cols = { 'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4, 'f': 5, 'g': 6, 'h': 7 }
     cols_to_files = { v: k for k, v in files_to_cols.items() }
+    # underpromotions get their own move_id range, a queen promotion keeps the plain id
+    # so a move built from two mouse clicks matches it
+    promotion_ids = { 'Q': 0, 'R': 10000, 'B': 20000, 'N': 30000 }
 
-    def __init__(self, start, end, board, pawn_promotion = False, enpassant=False, castle = False):
+    # searches create millions of moves, no per-instance __dict__
+    __slots__ = ('start_row', 'start_col', 'end_row', 'end_col', 'piece_moved', 'piece_captured',
+                 'enpassant', 'pawn_promotion', 'promotion_piece', 'castle', 'is_capture', 'move_id')
+
+    def __init__(self, start, end, board, pawn_promotion = False, enpassant=False, castle = False, promotion_piece = 'Q'):
         self.start_row = start[0]
         self.start_col = start[1]
         self.end_row = end[0]
@@ -584,13 +984,16 @@ class Move():
         self.piece_captured = board[self.end_row][self.end_col]     # what is being captured            
         self.enpassant = enpassant                                  # is the move enpassant
         self.pawn_promotion = pawn_promotion                        # is the move pawn promotion
+        self.promotion_piece = promotion_piece                      # what the pawn becomes: 'Q', 'R', 'B' or 'N'
         self.castle = castle
         if self.enpassant:
             self.piece_captured = 'bP' if self.piece_moved == 'wP' else 'wP'
 
         self.is_capture = self.piece_captured != '--' 
-        # unique id generation from 0 - 7000
+        # unique id generation from 0 - 7777, plus the underpromotion ranges
         self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        if pawn_promotion:
+            self.move_id += self.promotion_ids[promotion_piece]
 
         # old pawn promotion
         # self.is_pawn_promotion = (self.piece_moved == 'wP' and self.end_row == 0) or (self.piece_moved == 'bP' and self.end_row == 7)
@@ -598,6 +1001,12 @@ class Move():
     def get_chess_notation(self):
         return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
 
+    ''' long algebraic notation as used by UCI, e7e8q for promotions '''
+    def get_uci_notation(self):
+        if self.pawn_promotion:
+            return self.get_chess_notation() + self.promotion_piece.lower()
+        return self.get_chess_notation()
+
     def get_rank_file(self, row, col):
         return self.cols_to_files[col] + self.rows_to_ranks[row]
 
@@ -608,6 +1017,9 @@ class Move():
             return self.move_id == other.move_id
         return False
 
+    def __hash__(self):
+        return self.move_id
+
     ''' OVERRIDE str 
         mock chess notation
     '''
@@ -617,6 +1029,8 @@ class Move():
         
         end_sq = self.get_rank_file(self.end_row, self.end_col)
         if self.piece_moved[1] == 'P':
+            if self.pawn_promotion and self.promotion_piece != 'Q':
+                end_sq += '=' + self.promotion_piece
             if self.is_capture:
                 return self.cols_to_files[self.start_row] + 'x' + end_sq
             else:
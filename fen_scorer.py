@@ -0,0 +1,259 @@
+'''
+Vectorised FEN scorer for analysis
+scores files of FEN / EPD positions with NumPy, it is not part of the engine: the search never calls it
+positions are packed into an (N, 64) int8 array, one piece code per square (row 0 is the 8th rank like GameState.board),
+and all of them are scored at once with array operations instead of one python loop per position
+
+terms, all in centipawns and positive for white:
+    material, position      the same tables as the gamestate's running totals (engine.piece_values, piece_square_tables)
+    mobility                squares knights, bishops, rooks and queens can move to, sliders stop at the first piece
+    pawns                   doubled and isolated pawns, passed pawns by how far they got
+
+the search keeps ai.score_board: the mobility and pawn terms are on another scale than its running totals,
+and ai.score_board only reads totals the gamestate keeps up to date, so inside a search it is much faster per
+position than packing one would be, the array scoring pays off when the positions come as text (FEN / EPD input)
+
+usage
+    python fen_scorer.py score positions.epd --output scores.jsonl
+    python fen_scorer.py bench --positions 20000        throughput against GameState(fen) + ai.score_board
+'''
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+import ai
+import analyse
+import engine
+
+BATCH_SIZE = 4096       # positions packed per batch when scoring a file
+MOBILITY_WEIGHT = 3     # per square
+DOUBLED_PAWN = -15      # per pawn more than one on a file
+ISOLATED_PAWN = -12     # per pawn with no own pawns on the files next to it
+PASSED_PAWN = [0, 100, 60, 35, 20, 10, 5, 0]    # by row, for a pawn moving towards row 0 (white's direction)
+
+# piece codes: 0 empty, 1 to 6 white pawn, knight, bishop, rook, queen, king, negative for black
+PIECE_CODES = {'--': 0}
+for code, piece in enumerate('PNBRQK', 1):
+    PIECE_CODES['w' + piece] = code
+    PIECE_CODES['b' + piece] = -code
+OFF_BOARD = 7           # code of the extra square the rays run into at the edge
+
+# tables indexed by code + 6
+MATERIAL = np.zeros(13, dtype=np.int32)
+POSITION = np.zeros((13, 64), dtype=np.int32)
+for piece, code in PIECE_CODES.items():
+    if code != 0:
+        MATERIAL[code + 6] = engine.material_values[piece]
+        POSITION[code + 6] = engine.position_values[piece]
+SQUARES = np.arange(64)
+
+# KNIGHT_TARGETS[a, b] is 1 if a knight on a attacks b
+KNIGHT_TARGETS = np.zeros((64, 64), dtype=np.float32)
+for sq in range(64):
+    for d_row, d_col in engine.knight_offsets:
+        row, col = sq // 8 + d_row, sq % 8 + d_col
+        if 0 <= row < 8 and 0 <= col < 8:
+            KNIGHT_TARGETS[sq, row * 8 + col] = 1
+
+# RAY_STEPS[d][k, sq]: square k + 1 steps from sq in direction engine.directions[d], 64 (off the board) past the edge
+RAY_STEPS = np.full((8, 7, 64), 64, dtype=np.intp)
+for d, (d_row, d_col) in enumerate(engine.directions):
+    for sq in range(64):
+        for k in range(7):
+            row, col = sq // 8 + d_row * (k + 1), sq % 8 + d_col * (k + 1)
+            if not (0 <= row < 8 and 0 <= col < 8):
+                break
+            RAY_STEPS[d, k, sq] = row * 8 + col
+ROWS = np.arange(8).reshape(1, 8, 1)
+
+''' the 64 piece codes of a GameState.board '''
+def board_codes(board):
+    return [PIECE_CODES[piece] for row in board for piece in row]
+
+''' (N, 64) int8 array of a list of board_codes lists '''
+def pack(boards):
+    return np.array(boards, dtype=np.int8).reshape(-1, 64)
+
+''' (N, 64) int8 array of the piece placements of FEN strings, without building a GameState for each '''
+def pack_fens(fens):
+    boards = []
+    for fen in fens:
+        codes = []
+        for char in fen.split(None, 1)[0]:
+            if char.isdigit():
+                codes.extend([0] * int(char))
+            elif char != '/':
+                codes.append(PIECE_CODES[('w' if char.isupper() else 'b') + char.upper()])
+        if len(codes) != 64:
+            raise ValueError('FEN board must be 8x8: ' + fen)
+        boards.append(codes)
+    return pack(boards)
+
+''' squares the knights, bishops, rooks and queens of each side can move to (empty or enemy), white minus black '''
+def mobility(codes):
+    # knight moves: how many knights of each side attack every square, counted where the square isn't their own
+    white_attacks = (codes == 2).astype(np.float32) @ KNIGHT_TARGETS
+    black_attacks = (codes == -2).astype(np.float32) @ KNIGHT_TARGETS
+    total = (white_attacks * (codes <= 0)).sum(axis=1) - (black_attacks * (codes >= 0)).sum(axis=1)
+
+    # sliders: walk the rays of every bishop, rook and queen at once, as flat arrays of (position, square)
+    # pairs rather than whole boards, a position only has a few of them
+    padded = np.concatenate([codes, np.full((len(codes), 1), OFF_BOARD, dtype=codes.dtype)], axis=1)
+    positions, squares = np.nonzero((np.abs(codes) >= 3) & (np.abs(codes) <= 5))
+    pieces = codes[positions, squares]
+    sides = np.sign(pieces)
+    pieces = np.abs(pieces)
+    landed = []
+    weights = []
+    for d in range(8):
+        moving = (pieces != 3) if d < 4 else (pieces != 4)   # rooks and queens go straight, bishops and queens diagonally
+        ray_positions, ray_squares, ray_sides = positions[moving], squares[moving], sides[moving]
+        for k in range(7):
+            target = padded[ray_positions, RAY_STEPS[d, k, ray_squares]]
+            # a move lands on an empty or enemy square: target code has the other sign or is 0
+            free = (target != OFF_BOARD) & (target * ray_sides <= 0)
+            landed.append(ray_positions[free])
+            weights.append(ray_sides[free])
+            empty = target == 0     # only an empty square lets the ray go on
+            ray_positions, ray_squares, ray_sides = ray_positions[empty], ray_squares[empty], ray_sides[empty]
+            if len(ray_positions) == 0:
+                break
+    total += np.bincount(np.concatenate(landed), np.concatenate(weights), minlength=len(codes))
+    return total.astype(np.int32)
+
+''' doubled, isolated and passed pawn score of own pawns moving towards row 0, (N, 8, 8) boolean boards '''
+def pawn_score(own, enemy):
+    counts = own.sum(axis=1)
+    doubled = np.maximum(counts - 1, 0).sum(axis=1)
+    has = np.pad(counts > 0, ((0, 0), (1, 1)))
+    isolated = (counts * (~has[:, :-2] & ~has[:, 2:])).sum(axis=1)
+    # a pawn is passed if no enemy pawn is on a row in front of it (smaller row) on its own or the next files
+    front = np.where(enemy.any(axis=1), enemy.argmax(axis=1), 8)
+    front = np.pad(front, ((0, 0), (1, 1)), constant_values=8)
+    front = np.minimum(np.minimum(front[:, :-2], front[:, 1:-1]), front[:, 2:])
+    passed = own & (front[:, np.newaxis, :] >= ROWS)
+    passed_score = (passed * np.array(PASSED_PAWN).reshape(1, 8, 1)).sum(axis=(1, 2))
+    return DOUBLED_PAWN * doubled + ISOLATED_PAWN * isolated + passed_score
+
+''' every term for every position: dict of (N,) int32 arrays, positive is good for white '''
+def evaluate_terms(packed):
+    codes = packed.astype(np.int32)
+    index = codes + 6
+    white_pawns = (codes == 1).reshape(-1, 8, 8)
+    black_pawns = (codes == -1).reshape(-1, 8, 8)
+    return {
+        'material': MATERIAL[index].sum(axis=1),
+        'position': POSITION[index, SQUARES].sum(axis=1),
+        'mobility': MOBILITY_WEIGHT * mobility(codes),
+        # black's pawns are scored on the mirrored board, so they also move towards row 0
+        'pawns': (pawn_score(white_pawns, black_pawns) - pawn_score(black_pawns[:, ::-1], white_pawns[:, ::-1])).astype(np.int32),
+    }
+
+''' total score of every position, (N,) int32, positive is good for white '''
+def evaluate(packed):
+    return sum(evaluate_terms(packed).values())
+
+''' scores every position of an EPD (or FEN per line) file, BATCH_SIZE at a time, calls write(record) in input order '''
+def score_file(path, write):
+    positions = 0
+    batch = []
+    def flush():
+        terms = evaluate_terms(pack_fens([fen for _, fen in batch]))
+        for i, (number, fen) in enumerate(batch):
+            record = {'line': number, 'fen': fen, 'terms': {name: int(values[i]) for name, values in terms.items()}}
+            record['score'] = sum(record['terms'].values())
+            write(record)
+        batch.clear()
+
+    for number, line in analyse.read_lines(path):
+        batch.append((number, analyse.parse_epd(line)[0]))
+        positions += 1
+        if len(batch) == BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+    return positions
+
+''' FENs of positions from random games, a new game after checkmate, stalemate or 80 plies '''
+def random_fens(count, seed=0):
+    random.seed(seed)
+    fens = []
+    gs = engine.GameState()
+    while len(fens) < count:
+        valid_moves = gs.get_valid_moves()
+        if len(valid_moves) == 0 or len(gs.move_log) >= 80:
+            gs = engine.GameState()
+            continue
+        gs.make_a_move(random.choice(valid_moves))
+        fens.append(gs.get_fen())
+    return fens
+
+''' positions per second: ai.score_board looped over ready gamestates and over gamestates built from FEN,
+    against evaluate of already packed positions and pack_fens + evaluate
+'''
+def bench(count):
+    fens = random_fens(count)
+    timings = {}
+    start = time.perf_counter()
+    states = [engine.GameState(fen) for fen in fens]
+    setup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for gs in states:
+        ai.score_board(gs)
+    timings['score_board'] = time.perf_counter() - start
+    timings['GameState(fen) + score_board'] = setup + timings['score_board']
+
+    packed = pack([board_codes(gs.board) for gs in states])
+    start = time.perf_counter()
+    terms = evaluate_terms(packed)
+    timings['evaluate'] = time.perf_counter() - start
+    start = time.perf_counter()
+    index = packed.astype(np.int32) + 6
+    MATERIAL[index].sum(axis=1) + POSITION[index, SQUARES].sum(axis=1)
+    timings['evaluate, material + position only'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for first in range(0, len(fens), BATCH_SIZE):
+        evaluate(pack_fens(fens[first:first + BATCH_SIZE]))
+    timings['pack_fens + evaluate'] = time.perf_counter() - start
+
+    # the two must agree on the terms they share
+    same = all(int(terms['material'][i] + terms['position'][i]) == gs.material_score + gs.position_score
+               for i, gs in enumerate(states))
+    return len(fens), {name: int(len(fens) / seconds) for name, seconds in timings.items()}, same
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='vectorised FEN scorer (NumPy)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    score = commands.add_parser('score', help='score every position of an EPD file')
+    score.add_argument('epd')
+    score.add_argument('--output', help='JSON lines file (default standard output)')
+    speed = commands.add_parser('bench', help='positions per second against ai.score_board')
+    speed.add_argument('--positions', type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        positions, rates, same = bench(args.positions)
+        print(str(positions) + ' positions, material + position ' + ('agree' if same else 'DIFFER') + ' with score_board')
+        for name, rate in rates.items():
+            print('{:<36} {:>9} positions/s'.format(name, rate))
+        return 0 if same else 1
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    def write(record):
+        out.write(json.dumps(record) + '\n')
+
+    start = time.perf_counter()
+    positions = score_file(args.epd, write)
+    if args.output:
+        out.close()
+    print(str(positions) + ' positions in ' + str(round(time.perf_counter() - start, 2)) + 's', file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
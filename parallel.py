@@ -0,0 +1,320 @@
+'''
+Parallel root split search
+every iteration of the iterative deepening shares the root moves out over a multiprocessing pool,
+each worker searches its moves on its own copy of the GameState, with its own transposition table
+the first (best so far) move is searched in this process first (in an aspiration window), its score is
+the alpha the workers start from, the alpha is shared: a worker starts each move with the best score any worker
+has found so far, and tries it with a null window first (principal variation search at the root),
+while searching it reads the shared alpha again after every move at ply 1 (ai.root_alpha)
+a task only carries the root position (a FEN and the moves since the last capture or pawn move, so repetitions
+are still seen), the root move and the ai, engine and tablebase settings of the search, the pool is kept
+between searches and every worker takes the settings of the search it works for
+root moves late in the ordering get the same late move reduction as in ai.negamax
+the workers are spawned, a script that searches with workers needs an if __name__ == '__main__': guard
+
+usage
+    ai.negamax_helper(gs, valid_moves, workers=8)       or set ai.WORKERS
+    python parallel.py --depth 4 --workers 1 2 4 8      scaling benchmark, time to depth per worker count
+'''
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+
+import ai
+import engine
+import tablebase
+
+POLL = 0.01         # seconds between deadline / stop checks while the workers search
+SETTING_MODULES = (ai, engine, tablebase)   # their upper case names with plain values are sent to the workers
+
+# positions for the benchmark: start position, kiwipete, position 6 of the perft suite
+BENCHMARK_FENS = [
+    engine.START_FEN,
+    'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+    'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+]
+
+pools = {}          # worker count -> (pool, shared alpha, stop event), kept between searches
+search_id = 0       # tells the workers a new search started
+
+# worker process state
+shared_alpha = None
+shared_stop = None
+worker_search_id = None
+worker_settings = None
+worker_root = None  # (gamestate, valid moves by UCI notation) of the search's root position
+
+def init_worker(alpha, stop):
+    global shared_alpha, shared_stop
+    shared_alpha = alpha
+    shared_stop = stop
+
+''' one pool per worker count, created on first use
+    the workers are started fresh (spawn): forking from the search thread while the main thread reads stdin
+    (uci.py) copies its held stdin lock into the child, which then hangs when multiprocessing closes stdin
+'''
+def get_pool(workers):
+    if workers not in pools:
+        context = multiprocessing.get_context('spawn')
+        alpha = context.Value('i', 0)
+        stop = context.Event()
+        pool = context.Pool(workers, initializer=init_worker, initargs=(alpha, stop))
+        pools[workers] = (pool, alpha, stop)
+    return pools[workers]
+
+def close_pools():
+    for pool, alpha, stop in pools.values():
+        pool.terminate()
+        pool.join()
+    pools.clear()
+
+''' the settings of this process for the workers: (module, name, value) of every upper case plain value '''
+def current_settings():
+    return tuple((module.__name__, name, value) for module in SETTING_MODULES for name, value in sorted(vars(module).items())
+                 if name.isupper() and isinstance(value, (bool, int, float, str, type(None))))
+
+''' (FEN, UCI moves): gs from before the last capture or pawn move and the moves since
+    earlier positions can't repeat, so the workers see the same repetitions as this process
+'''
+def root_position(gs):
+    moves = gs.move_log[len(gs.move_log) - min(gs.halfmove_clock, len(gs.move_log)):]
+    for _ in moves:
+        gs.undo_a_move()
+    fen = gs.get_fen()
+    for move in moves:
+        gs.make_a_move(move)
+    return fen, [move.get_uci_notation() for move in moves]
+
+''' runs in a worker once per search: take over its settings and set up its root position '''
+def start_search(settings, position):
+    global worker_settings, worker_root
+    if settings != worker_settings:
+        for module_name, name, value in settings:
+            setattr(sys.modules[module_name], name, value)
+        if len(ai.transposition_table.table) != ai.TT_SIZE:
+            ai.transposition_table = ai.TranspositionTable(ai.TT_SIZE)
+        worker_settings = settings
+    fen, moves = position
+    gs = engine.GameState(fen)
+    for text in moves:
+        gs.make_a_move(next(move for move in gs.get_valid_moves() if move.get_uci_notation() == text))
+    worker_root = gs, {move.get_uci_notation(): move for move in gs.get_valid_moves()}
+    ai.transposition_table.new_search()
+    ai.new_ordering_search()
+
+''' runs in a worker: the score of one root move from the root side's point of view
+    returns (index, score, exact, nodes), score is None if the search was stopped
+    exact is False when the move failed low, its score is then only an upper bound
+'''
+def search_root_move(task):
+    global worker_search_id
+    search, settings, position, index, move_text, depth, time_left, node_budget = task
+    if shared_stop.is_set():
+        return index, None, False, 0
+    if search != worker_search_id:
+        worker_search_id = search
+        start_search(settings, position)
+    gs, root_moves = worker_root
+    ai.nodes = 0
+    ai.deadline = None if time_left is None else time.perf_counter() + time_left
+    ai.max_nodes = node_budget
+    ai.stop_event = shared_stop
+    ai.ponder_event = None  # ponderhit is seen by the main process, it stops the workers
+    ai.root_alpha = shared_alpha
+    ai.stats = None     # telemetry is only kept in the main process
+
+    alpha = shared_alpha.value
+    turn = 1 if gs.whites_turn else -1
+    ply_count = len(gs.move_log)
+    move = root_moves[move_text]
+    in_check = ai.gives_check(gs)
+    gs.make_a_move(move)
+    try:
+        # late move reductions as at the root of ai.negamax, index is the move's place in the ordering
+        reduction = 0
+        if (ai.USE_LMR and index >= ai.LMR_MIN_MOVES and depth >= ai.LMR_MIN_DEPTH and not in_check
+                and move.piece_captured == '--' and not move.pawn_promotion and not ai.gives_check(gs)):
+            reduction = 1
+        # null window first: most moves only have to be shown no better than alpha
+        score = ai.CHECKMATE
+        if ai.USE_PVS or reduction:
+            score = -ai.negamax(gs, None, depth - 1 - reduction, -alpha - 1, -alpha, -turn, 1)
+        if score > alpha and reduction and ai.USE_PVS:
+            score = -ai.negamax(gs, None, depth - 1, -alpha - 1, -alpha, -turn, 1)
+        alpha = shared_alpha.value
+        if score > alpha:
+            score = -ai.negamax(gs, None, depth - 1, -ai.CHECKMATE, -alpha, -turn, 1)
+    except ai.SearchTimeout:
+        score = None
+    while len(gs.move_log) > ply_count:    # the root position is kept for the next task
+        gs.undo_a_move()
+    if score is None:
+        return index, None, False, ai.nodes
+    with shared_alpha.get_lock():
+        # above every alpha the search saw, so never cut by one: exact, otherwise an upper bound
+        exact = score > shared_alpha.value
+        if exact:
+            shared_alpha.value = score
+    return index, score, exact, ai.nodes
+
+''' one iteration: the first move in this process, the others on the pool
+    returns a list of (score, exact) per move, or None if the time ran out or the search was stopped
+    the deadline is ai.deadline, read on every poll, so a deadline set while searching (ponderhit) stops the workers
+    previous: score of the last iteration, the first move is searched in a window around it first
+    root: (search id, settings, root position) sent with every task
+'''
+def search_iteration(gs, moves, depth, pool, alpha, stop_workers, node_limit, stop, previous, root):
+    turn = 1 if gs.whites_turn else -1
+    results = [None] * len(moves)
+    ply_count = len(gs.move_log)
+    try:
+        gs.make_a_move(moves[0])
+        low, high = -ai.CHECKMATE, ai.CHECKMATE
+        if ai.USE_ASPIRATION and previous is not None and abs(previous) < ai.MATE_SCORE:
+            low, high = previous - ai.ASPIRATION_WINDOW, previous + ai.ASPIRATION_WINDOW
+        score = -ai.negamax(gs, None, depth - 1, -high, -low, -turn, 1)
+        if not low < score < high and (low, high) != (-ai.CHECKMATE, ai.CHECKMATE):
+            if ai.stats is not None:
+                ai.stats.aspiration_researches += 1
+            score = -ai.negamax(gs, None, depth - 1, -ai.CHECKMATE, ai.CHECKMATE, -turn, 1)
+        results[0] = (score, True)
+        gs.undo_a_move()
+    except ai.SearchTimeout:
+        while len(gs.move_log) > ply_count:
+            gs.undo_a_move()
+        return None
+    if len(moves) == 1:
+        return results
+
+    alpha.value = results[0][0]
+    time_left = None if ai.deadline is None else max(ai.deadline - time.perf_counter(), 0)
+    node_budget = None if node_limit is None else max(node_limit - ai.nodes, 1)   # per worker, so the total is approximate
+    tasks = [root + (index, moves[index].get_uci_notation(), depth, time_left, node_budget) for index in range(1, len(moves))]
+    pending = pool.imap_unordered(search_root_move, tasks)
+    stopped = False
+    for _ in range(len(tasks)):
+        while True:
+            try:
+                index, score, exact, nodes = pending.next(timeout=POLL)
+                break
+            except multiprocessing.TimeoutError:
+                if ai.search_depth > 0:     # the first iteration always completes
+                    ai.check_ponderhit()
+                if not stopped and ((ai.deadline is not None and time.perf_counter() >= ai.deadline) or
+                                    (stop is not None and stop.is_set())):
+                    stop_workers.set()  # the workers see it within CHECK_EVERY nodes
+                    stopped = True
+        ai.nodes += nodes
+        if score is None:
+            stopped = True
+        results[index] = (score, exact)
+    stop_workers.clear()
+    return None if stopped else results
+
+''' iterative deepening like ai.negamax_helper (same limits, same globals filled in),
+    with the root moves of each iteration split over a pool of workers processes
+'''
+def negamax_helper(gs, valid_moves, workers, max_depth=None, time_limit=None, node_limit=None, stop=None, on_iteration=None, ponder=None):
+    global search_id
+    time_limit = ai.TIME_LIMIT if time_limit is None else time_limit
+    node_limit = ai.NODE_LIMIT if node_limit is None else node_limit
+    if max_depth is None:
+        max_depth = ai.DEPTH if time_limit is None and node_limit is None else ai.MAX_DEPTH
+    ai.next_move = None
+    ai.nodes = 0
+    ai.search_depth = 0
+    ai.search_score = 0
+    ai.principal_variation = []
+    ai.deadline = None
+    ai.max_nodes = None
+    ai.stop_event = stop
+    if len(valid_moves) == 0:
+        return None
+
+    time_limit = ai.start_ponder(ponder, time_limit)
+    pool, alpha, stop_workers = get_pool(workers)
+    search_id += 1
+    root = (search_id, current_settings(), root_position(gs))
+    random.shuffle(valid_moves)
+    ai.transposition_table.new_search()
+    ai.new_ordering_search()
+    ai.order_moves(valid_moves, None, 0)
+    moves = list(valid_moves)
+    start = time.perf_counter()
+    max_nodes = None
+    best_move = None
+    score = None
+    for depth in range(1, max_depth + 1):
+        results = search_iteration(gs, moves, depth, pool, alpha, stop_workers, max_nodes, stop, score, root)
+        if results is None:
+            break
+        # best first for the next iteration, a fail low move never goes before an exact one with the same score
+        order = sorted(range(len(moves)), key=lambda i: results[i], reverse=True)
+        moves = [moves[i] for i in order]
+        score = results[order[0]][0]
+        best_move = moves[0]
+        ai.search_depth = depth
+        ai.search_score = score
+        # the pv table of this process only has the line of the first move, the rest comes from the transposition table
+        ai.principal_variation = ai.get_pv(gs, [best_move], depth)
+        if ai.stats is not None:
+            ai.stats.end_iteration(depth, score, ai.nodes)
+        if on_iteration is not None:
+            on_iteration(depth, score, ai.nodes, time.perf_counter() - start, ai.principal_variation)
+
+        # limits only apply once there is a move to play
+        if time_limit is not None:
+            ai.deadline = start + time_limit
+        ai.check_ponderhit()
+        if node_limit is not None:
+            max_nodes = node_limit
+            ai.max_nodes = max_nodes
+        if len(moves) == 1 or abs(score) >= ai.MATE_IN_MAX:
+            break
+        if ai.deadline is not None and time.perf_counter() >= ai.deadline:
+            break
+        if max_nodes is not None and ai.nodes >= max_nodes:
+            break
+        if stop is not None and stop.is_set():
+            break
+
+    ai.next_move = best_move
+    return best_move
+
+''' time to depth for each worker count, summed over the positions '''
+def benchmark(depth, worker_counts, fens):
+    ai.USE_BOOK = False
+    base = None
+    for workers in worker_counts:
+        close_pools()
+        if workers > 1:
+            get_pool(workers)   # start the processes before the clock
+        ai.transposition_table.clear()
+        seconds = 0
+        nodes = 0
+        for fen in fens:
+            gs = engine.GameState()
+            gs.load_fen(fen)
+            random.seed(0)
+            start = time.perf_counter()
+            ai.negamax_helper(gs, gs.get_valid_moves(), max_depth=depth, workers=workers)
+            seconds += time.perf_counter() - start
+            nodes += ai.nodes
+        base = seconds if base is None else base
+        print('{:>3} workers {:>8.3f}s {:>10} nodes {:>9} nps  speedup {:.2f}'.format(
+            workers, seconds, nodes, int(nodes / seconds) if seconds > 0 else '-', base / seconds if seconds > 0 else 0))
+    close_pools()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='time to depth of the parallel search per worker count')
+    parser.add_argument('--depth', type=int, default=4, help='search depth (default 4)')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8, 16], help='worker counts, the first is the baseline')
+    parser.add_argument('--fen', help='position to search instead of the benchmark positions')
+    args = parser.parse_args(argv)
+    benchmark(args.depth, args.workers, [args.fen] if args.fen else BENCHMARK_FENS)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
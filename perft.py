@@ -0,0 +1,170 @@
+'''
+Perft: counts the leaf nodes of the legal move tree to a fixed depth
+a count that differs from the reference means a move generation (or make/undo) bug,
+the time it takes is a benchmark for get_valid_moves + make_a_move + undo_a_move
+
+usage
+    python perft.py                                 run the reference suite up to depth 3
+    python perft.py --depth 4                       deeper
+    python perft.py --fen "<fen>" --depth 3         one position, node count per depth
+    python perft.py --fen "<fen>" --depth 3 --divide
+                                                    node count per root move at the last depth
+    --output results.json                           also write the results as JSON
+exit status is 1 if any count differs from the reference
+'''
+import argparse
+import json
+import sys
+import time
+
+import engine
+
+'''
+reference positions and their known node counts, index 0 is depth 1
+the first six are the usual chess programming wiki positions, the rest are edge cases
+(en passant legality, castling through/into check, promotions, stalemate and mate)
+'''
+SUITE = [
+    ('start position', engine.START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+     [48, 2039, 97862, 4085603]),
+    ('position 3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+     [14, 191, 2812, 43238, 674624]),
+    ('position 4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+     [6, 264, 9467, 422333]),
+    ('position 5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+     [44, 1486, 62379, 2103487]),
+    ('position 6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+     [46, 2079, 89890, 3894594]),
+    ('illegal en passant 1', '3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1',
+     [18, 92, 1670, 10138, 185429, 1134888]),
+    ('illegal en passant 2', '8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1',
+     [13, 102, 1266, 10276, 135655, 1015133]),
+    ('en passant gives check', '8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1',
+     [15, 126, 1928, 13931, 206379, 1440467]),
+    ('short castle gives check', '5k2/8/8/8/8/8/8/4K2R w K - 0 1',
+     [15, 66, 1198, 6399, 120330, 661072]),
+    ('long castle gives check', '3k4/8/8/8/8/8/8/R3K3 w Q - 0 1',
+     [16, 71, 1286, 7418, 141077, 803711]),
+    ('castling rights', 'r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1',
+     [26, 1141, 27826, 1274206]),
+    ('castling prevented', 'r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1',
+     [44, 1494, 50509, 1720476]),
+    ('promote out of check', '2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1',
+     [11, 133, 1442, 19174, 266199, 3821001]),
+    ('discovered check', '8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1',
+     [29, 165, 5160, 31961, 1004658]),
+    ('promote to give check', '4k3/1P6/8/8/8/8/K7/8 w - - 0 1',
+     [9, 40, 472, 2661, 38983, 217342]),
+    ('underpromote to check', '8/P1k5/K7/8/8/8/8/8 w - - 0 1',
+     [6, 27, 273, 1329, 18135, 92683]),
+    ('self stalemate', 'K1k5/8/P7/8/8/8/8/8 w - - 0 1',
+     [2, 6, 13, 63, 382, 2217]),
+    ('stalemate and checkmate 1', '8/k1P5/8/1K6/8/8/8/8 w - - 0 1',
+     [10, 25, 268, 926, 10857, 43261, 567584]),
+    ('stalemate and checkmate 2', '8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1',
+     [37, 183, 6559, 23527]),
+]
+
+
+''' number of leaf nodes depth plies below the current position '''
+def perft(gs, depth):
+    moves = gs.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.make_a_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_a_move()
+    return nodes
+
+''' perft split by root move, returns a list of (move, nodes) '''
+def divide(gs, depth):
+    results = []
+    for move in gs.get_valid_moves():
+        gs.make_a_move(move)
+        nodes = perft(gs, depth - 1) if depth > 1 else 1
+        gs.undo_a_move()
+        results.append((move, nodes))
+    return results
+
+''' runs perft on one position for every depth up to max_depth, prints a line per depth and returns result records '''
+def run_position(name, fen, max_depth, expected=None):
+    records = []
+    for depth in range(1, max_depth + 1):
+        gs = engine.GameState(fen)
+        start = time.perf_counter()
+        nodes = perft(gs, depth)
+        seconds = time.perf_counter() - start
+        reference = expected[depth - 1] if expected is not None and depth <= len(expected) else None
+        record = {
+            'name': name,
+            'fen': fen,
+            'depth': depth,
+            'nodes': nodes,
+            'expected': reference,
+            'passed': None if reference is None else nodes == reference,
+            'seconds': round(seconds, 4),
+            'nps': int(nodes / seconds) if seconds > 0 else None,
+        }
+        status = '' if reference is None else ('ok' if nodes == reference else 'FAIL (expected ' + str(reference) + ')')
+        print('{:<28} depth {:<2} {:>10} nodes {:>8.3f}s {:>9} nps  {}'.format(
+            name, depth, nodes, seconds, record['nps'] or '-', status))
+        records.append(record)
+    return records
+
+def run_suite(max_depth):
+    records = []
+    for name, fen, expected in SUITE:
+        records.extend(run_position(name, fen, min(max_depth, len(expected)), expected))
+    return records
+
+def run_divide(fen, depth):
+    gs = engine.GameState(fen)
+    start = time.perf_counter()
+    results = divide(gs, depth)
+    seconds = time.perf_counter() - start
+    total = 0
+    records = []
+    for move, nodes in sorted(results, key=lambda result: result[0].get_uci_notation()):
+        print(move.get_uci_notation() + ': ' + str(nodes))
+        total += nodes
+        records.append({'move': move.get_uci_notation(), 'nodes': nodes})
+    print()
+    print('moves: ' + str(len(results)) + '  nodes: ' + str(total) + '  ' + str(int(total / seconds) if seconds > 0 else '-') + ' nps')
+    return [{'fen': fen, 'depth': depth, 'nodes': total, 'seconds': round(seconds, 4), 'divide': records}]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='perft node counts and move generation speed')
+    parser.add_argument('--fen', help='position to run instead of the reference suite')
+    parser.add_argument('--depth', type=int, default=3, help='maximum depth (default 3)')
+    parser.add_argument('--divide', action='store_true', help='with --fen: node count per root move')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    if args.fen and args.divide:
+        records = run_divide(args.fen, args.depth)
+    elif args.fen:
+        records = run_position('fen', args.fen, args.depth)
+    else:
+        records = run_suite(args.depth)
+
+    total_nodes = sum(record['nodes'] for record in records)
+    total_seconds = sum(record['seconds'] for record in records)
+    failed = [record for record in records if record.get('passed') is False]
+    if not args.divide:
+        print()
+        print('total ' + str(total_nodes) + ' nodes in ' + str(round(total_seconds, 3)) + 's, ' +
+              str(int(total_nodes / total_seconds) if total_seconds > 0 else '-') + ' nps, ' + str(len(failed)) + ' failed')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'nodes': total_nodes, 'seconds': round(total_seconds, 4),
+                       'failed': len(failed), 'results': records}, f, indent=2)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
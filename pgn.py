@@ -0,0 +1,135 @@
+'''
+Reading and writing PGN games
+read_games yields the games of a PGN file as (headers, moves in SAN),
+parse_san turns one SAN move into the matching engine.Move of a position, move_to_san does the opposite,
+format_game writes a game as PGN text
+'''
+import re
+
+import engine
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+HEADER_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+
+''' yields (headers, san moves) for every game in the file, comments, variations, NAGs and move numbers are dropped '''
+def read_games(path):
+    headers = {}
+    movetext = []
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            header = HEADER_PATTERN.match(line)
+            if header:
+                if movetext:    # a header after moves starts the next game
+                    yield headers, san_moves(' '.join(movetext))
+                    headers = {}
+                    movetext = []
+                headers[header.group(1)] = header.group(2)
+            elif line and not line.startswith('%'):
+                movetext.append(line)
+    if movetext:
+        yield headers, san_moves(' '.join(movetext))
+
+''' the moves of a game's movetext '''
+def san_moves(movetext):
+    movetext = re.sub(r'\{[^}]*\}', ' ', movetext)     # comments
+    movetext = re.sub(r';[^\n]*', ' ', movetext)
+    while '(' in movetext:                              # variations, innermost first
+        stripped = re.sub(r'\([^()]*\)', ' ', movetext)
+        if stripped == movetext:
+            break
+        movetext = stripped
+    moves = []
+    for token in movetext.split():
+        token = re.sub(r'^\d+\.+', '', token)         # move numbers, also when written as 1.e4
+        if token == '' or token in RESULTS or token.startswith('$'):
+            continue
+        moves.append(token)
+    return moves
+
+''' the move of valid_moves (default: all legal moves of gs) written as san, raises ValueError if there isn't exactly one '''
+def parse_san(gs, san, valid_moves=None):
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves()
+    san = san.rstrip('+#!?')
+    if san in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        end_col = 6 if len(san) == 3 else 2
+        candidates = [move for move in valid_moves if move.castle and move.end_col == end_col]
+    else:
+        match = SAN_PATTERN.match(san)
+        if match is None:
+            raise ValueError('not a SAN move: ' + san)
+        piece, from_file, from_rank, square, promotion = match.groups()
+        piece = piece or 'P'
+        end_row = engine.Move.ranks_to_rows[square[1]]
+        end_col = engine.Move.files_to_cols[square[0]]
+        candidates = []
+        for move in valid_moves:
+            if move.piece_moved[1] != piece or move.end_row != end_row or move.end_col != end_col or move.castle:
+                continue
+            if from_file is not None and move.start_col != engine.Move.files_to_cols[from_file]:
+                continue
+            if from_rank is not None and move.start_row != engine.Move.ranks_to_rows[from_rank]:
+                continue
+            if move.pawn_promotion and move.promotion_piece != (promotion or 'Q'):
+                continue
+            candidates.append(move)
+    if len(candidates) != 1:
+        raise ValueError(('ambiguous' if candidates else 'illegal') + ' move: ' + san)
+    return candidates[0]
+
+''' SAN of move (one of valid_moves, default: all legal moves of gs) in the position gs, with + or # '''
+def move_to_san(gs, move, valid_moves=None):
+    if valid_moves is None:
+        valid_moves = gs.get_valid_moves()
+    if move.castle:
+        san = 'O-O' if move.end_col == 6 else 'O-O-O'
+    elif move.piece_moved[1] == 'P':
+        san = move.cols_to_files[move.start_col] + 'x' if move.is_capture else ''
+        san += move.get_rank_file(move.end_row, move.end_col)
+        if move.pawn_promotion:
+            san += '=' + move.promotion_piece
+    else:
+        others = [other for other in valid_moves if other.piece_moved == move.piece_moved and
+                  other.end_row == move.end_row and other.end_col == move.end_col and
+                  (other.start_row, other.start_col) != (move.start_row, move.start_col)]
+        disambiguation = ''
+        if others:
+            if all(other.start_col != move.start_col for other in others):
+                disambiguation = move.cols_to_files[move.start_col]
+            elif all(other.start_row != move.start_row for other in others):
+                disambiguation = move.rows_to_ranks[move.start_row]
+            else:
+                disambiguation = move.get_rank_file(move.start_row, move.start_col)
+        san = move.piece_moved[1] + disambiguation + ('x' if move.is_capture else '') + move.get_rank_file(move.end_row, move.end_col)
+
+    gs.make_a_move(move)
+    replies = gs.get_valid_moves()
+    if gs.in_check:
+        san += '#' if len(replies) == 0 else '+'
+    gs.undo_a_move()
+    return san
+
+''' PGN text of a game, headers in the given order, moves from the headers' FEN (or the start position) '''
+def format_game(headers, san_moves, result, start_ply=0):
+    lines = ['[' + tag + ' "' + str(value) + '"]' for tag, value in headers.items()]
+    tokens = []
+    for i, san in enumerate(san_moves):
+        ply = start_ply + i
+        if ply % 2 == 0:
+            tokens.append(str(ply // 2 + 1) + '.')
+        elif i == 0:
+            tokens.append(str(ply // 2 + 1) + '...')
+        tokens.append(san)
+    tokens.append(result)
+    movetext = []
+    line = ''
+    for token in tokens:    # lines of at most 80 characters
+        if line and len(line) + 1 + len(token) > 80:
+            movetext.append(line)
+            line = token
+        else:
+            line = token if not line else line + ' ' + token
+    movetext.append(line)
+    return '\n'.join(lines) + '\n\n' + '\n'.join(movetext) + '\n\n'
@@ -0,0 +1,211 @@
+'''
+Headless engine vs engine matches
+two engine settings (A and B) play each other without pygame, games run in parallel processes,
+A has white in the even games, B in the odd ones, with openings every opening is played once with each colour
+every finished game is appended to the PGN file and the summary (score, Elo difference with 95% error bars) is rewritten
+
+engine settings are comma separated key=value pairs:
+    depth, time, nodes      search limits per move (see ai.negamax_helper)
+    any ai module setting   e.g. USE_QUIESCENCE=0, USE_BOOK=0, DEPTH=2, TT_SIZE=65536
+                            except WORKERS: games already run in pool processes, which can't start a pool
+                            of their own, use --workers
+
+usage
+    python selfplay.py --games 100 --a depth=3 --b depth=2 --workers 8
+    python selfplay.py --games 1000 --a time=0.2 --b time=0.2,USE_QUIESCENCE=0 --openings openings.epd --pgn games.pgn
+    python selfplay.py --games 10 --telemetry search.jsonl     one search record per move, see telemetry.py
+'''
+import argparse
+import datetime
+import json
+import math
+import multiprocessing
+import random
+import sys
+import time
+
+import ai
+import analyse
+import engine
+import pgn
+import telemetry
+
+MAX_PLIES = 300     # longer games are adjudicated a draw
+LIMITS = {'depth': 'max_depth', 'time': 'time_limit', 'nodes': 'node_limit'}
+
+''' 'depth=3,USE_QUIESCENCE=0' -> {'depth': 3, 'USE_QUIESCENCE': False} '''
+def parse_settings(text):
+    settings = {}
+    for item in filter(None, text.split(',')):
+        key, _, value = item.partition('=')
+        key = key.strip()
+        if key not in LIMITS and not (key.isupper() and hasattr(ai, key)):
+            raise ValueError('unknown engine setting: ' + key)
+        if key == 'WORKERS':
+            raise ValueError('WORKERS can\'t be set, every game runs in one pool process (use --workers)')
+        current = getattr(ai, key, None)
+        if isinstance(current, bool):
+            settings[key] = value.strip().lower() in ('1', 'true', 'yes', 'on')
+        elif key == 'time' or isinstance(current, float):
+            settings[key] = float(value)
+        else:
+            settings[key] = int(value)
+    return settings
+
+''' both sides run in the same process: every move the ai settings are put back to the defaults, then one side's applied '''
+def apply_settings(settings, defaults):
+    for key, value in defaults.items():
+        setattr(ai, key, value)
+    for key, value in settings.items():
+        if key not in LIMITS:
+            setattr(ai, key, value)
+
+''' True if neither side can mate: bare kings, or a single knight or bishop against a bare king '''
+def insufficient_material(gs):
+    pieces = [piece[1] for row in gs.board for piece in row if piece != '--' and piece[1] != 'K']
+    return len(pieces) == 0 or (len(pieces) == 1 and pieces[0] in 'NB')
+
+''' plays one game in a worker, returns its record including the PGN text '''
+def play_game(task):
+    number, fen, a_is_white, settings_a, settings_b, max_plies = task
+    sides = {'w': ('A', settings_a), 'b': ('B', settings_b)} if a_is_white else {'w': ('B', settings_b), 'b': ('A', settings_a)}
+    defaults = {key: getattr(ai, key) for key in set(settings_a) | set(settings_b) if key not in LIMITS}
+    tables = {}     # each side keeps its own transposition table
+    random.seed(number)     # negamax_helper shuffles the moves, forked workers would otherwise repeat each other's games
+
+    gs = engine.GameState(fen)
+    start_ply = gs.start_ply
+    valid_moves = gs.get_valid_moves()
+    san_moves = []
+    nodes = {'A': 0, 'B': 0}
+    start = time.perf_counter()
+    while True:
+        if gs.checkmate:
+            result, termination = ('0-1' if gs.whites_turn else '1-0'), 'checkmate'
+            break
+        if gs.stalemate:
+            result, termination = '1/2-1/2', 'stalemate'
+            break
+        if insufficient_material(gs):
+            result, termination = '1/2-1/2', 'insufficient material'
+            break
+        if gs.is_repetition(2):
+            result, termination = '1/2-1/2', 'threefold repetition'
+            break
+        if gs.halfmove_clock >= 100:
+            result, termination = '1/2-1/2', 'fifty-move rule'
+            break
+        if len(san_moves) >= max_plies:
+            result, termination = '1/2-1/2', 'adjudicated after ' + str(max_plies) + ' plies'
+            break
+
+        name, settings = sides['w' if gs.whites_turn else 'b']
+        apply_settings(settings, defaults)
+        if name not in tables:
+            tables[name] = ai.TranspositionTable(ai.TT_SIZE)
+        ai.transposition_table = tables[name]
+        limits = {LIMITS[key]: value for key, value in settings.items() if key in LIMITS}
+        move = ai.negamax_helper(gs, valid_moves, workers=1, **limits)
+        if move is None:
+            move = ai.find_random_move(valid_moves)
+        nodes[name] += ai.nodes
+        san_moves.append(pgn.move_to_san(gs, move, valid_moves))
+        gs.make_a_move(move)
+        valid_moves = gs.get_valid_moves()
+
+    white, black = sides['w'][0], sides['b'][0]
+    headers = {'Event': 'selfplay', 'Site': '?', 'Date': datetime.date.today().strftime('%Y.%m.%d'), 'Round': number + 1,
+               'White': white, 'Black': black, 'Result': result}
+    if fen is not None:
+        headers['SetUp'] = '1'
+        headers['FEN'] = fen
+    headers['PlyCount'] = len(san_moves)
+    headers['Termination'] = termination
+    a_score = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}[result]
+    return {
+        'number': number,
+        'white': white,
+        'result': result,
+        'termination': termination,
+        'a_score': a_score if a_is_white else 1 - a_score,
+        'plies': len(san_moves),
+        'seconds': time.perf_counter() - start,
+        'nodes': nodes,
+        'pgn': pgn.format_game(headers, san_moves, result, start_ply),
+    }
+
+''' Elo difference of a score fraction, clamped so 0 and 1 stay finite '''
+def elo(score):
+    score = min(max(score, 1e-3), 1 - 1e-3)
+    return -400 * math.log10(1 / score - 1)
+
+''' match summary from A's point of view: wins, draws, losses, score, Elo difference and its 95% interval '''
+def summarize(wins, draws, losses, seconds, nodes):
+    games = wins + draws + losses
+    summary = {'games': games, 'wins': wins, 'draws': draws, 'losses': losses, 'seconds': round(seconds, 2), 'nodes': nodes}
+    if games == 0:
+        return summary
+    score = (wins + draws / 2) / games
+    deviation = math.sqrt((wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games)
+    margin = 1.96 * deviation / math.sqrt(games)
+    summary.update({
+        'score': round(score, 4),
+        'elo': round(elo(score), 1),
+        'elo_low': round(elo(score - margin), 1),
+        'elo_high': round(elo(score + margin), 1),
+    })
+    return summary
+
+''' the games to play, openings (FEN) are used in order, each one twice with the colours swapped '''
+def game_tasks(games, openings, settings_a, settings_b, max_plies):
+    for number in range(games):
+        fen = openings[(number // 2) % len(openings)] if openings else None
+        yield number, fen, number % 2 == 0, settings_a, settings_b, max_plies
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='engine vs engine match')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--a', default='depth=3', help='settings of engine A (default depth=3)')
+    parser.add_argument('--b', default='depth=3', help='settings of engine B (default depth=3)')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--openings', help='EPD or FEN file of start positions')
+    parser.add_argument('--max-plies', type=int, default=MAX_PLIES)
+    parser.add_argument('--pgn', default='selfplay.pgn', help='games are appended here')
+    parser.add_argument('--summary', default='selfplay.json', help='rewritten after every game')
+    parser.add_argument('--telemetry', help='search records of every move are appended here')
+    args = parser.parse_args(argv)
+
+    try:
+        settings_a = parse_settings(args.a)
+        settings_b = parse_settings(args.b)
+    except ValueError as error:
+        parser.error(str(error))
+    openings = [analyse.parse_epd(line)[0] for number, line in analyse.read_lines(args.openings)] if args.openings else []
+
+    wins = draws = losses = 0
+    nodes = 0
+    start = time.perf_counter()
+    tasks = game_tasks(args.games, openings, settings_a, settings_b, args.max_plies)
+    initializer, initargs = (telemetry.enable, (args.telemetry,)) if args.telemetry else (None, ())
+    with multiprocessing.Pool(args.workers, initializer, initargs) as pool, open(args.pgn, 'a') as pgn_file:
+        for record in pool.imap_unordered(play_game, tasks):
+            pgn_file.write(record['pgn'])
+            pgn_file.flush()
+            if record['a_score'] == 1:
+                wins += 1
+            elif record['a_score'] == 0:
+                losses += 1
+            else:
+                draws += 1
+            nodes += record['nodes']['A'] + record['nodes']['B']
+            summary = summarize(wins, draws, losses, time.perf_counter() - start, nodes)
+            summary.update({'a': args.a, 'b': args.b})
+            with open(args.summary, 'w') as f:
+                json.dump(summary, f, indent=2)
+            print('game {:>5} {} {:<7} {:<24} A {}-{}-{}  elo {}'.format(
+                record['number'] + 1, 'A white' if record['white'] == 'A' else 'B white', record['result'],
+                record['termination'], wins, draws, losses, summary['elo']))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
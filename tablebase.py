@@ -0,0 +1,347 @@
+'''
+Endgame tablebases
+win / draw / loss and distance to mate for every position of a material signature ('KQvK', 'KRvKN', ...)
+generated by retrograde analysis: every position's moves are generated once with engine.GameState,
+the moves are inverted into predecessor lists, then results spread backwards from the mates, one ply at a time
+
+a table is one byte per position, index = side to move + 2 * (sum of square * 64^i) over the pieces,
+white pieces then black, each side king first then Q R B N P
+    0           draw (or not a legal position)
+    1..127      side to move wins, mates in that many plies
+    128 + n     side to move loses, is mated in n plies
+the files (tablebases/KQvK.tb ...) are opened with mmap when first probed
+a signature is stored with the stronger side as white, the other colour order is probed mirrored
+castling and en passant are not in the tables, positions with either are not probed
+with pawns on both sides (KPvKP) a double push could be taken en passant, which the tables can't show,
+so those signatures are neither generated nor probed
+
+usage
+    python tablebase.py generate                    all 3 piece tables
+    python tablebase.py generate KRvKP KQvKR        tables needed for these are generated first
+    python tablebase.py probe --fen "<fen>"
+note: 4 piece tables work, but take a lot of time and memory in pure Python
+'''
+import argparse
+import mmap
+import os
+import sys
+import time
+from array import array
+
+import engine
+
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tablebases')
+MAX_PIECES = 4
+PIECE_ORDER = 'KQRBNP'
+THREE_PIECE = ['KQvK', 'KRvK', 'KBvK', 'KNvK', 'KPvK']
+LOSS = 128          # values from LOSS up are losses
+
+# probe results
+WIN = 1
+DRAW = 0
+LOSS_RESULT = -1
+
+tables = {}         # signature -> mmap of its file, False if there is no file
+
+''' (white types, black types) of a signature, 'KRvKN' -> ('KR', 'KN') '''
+def split_signature(signature):
+    white, black = signature.split('v')
+    return white, black
+
+''' True if both sides have pawns: their tables would need en passant, see the top of the file '''
+def needs_enpassant(signature):
+    white, black = split_signature(signature)
+    return 'P' in white and 'P' in black
+
+''' strength of one side for choosing which colour is stored as white: more pieces, then stronger pieces '''
+def strength(types):
+    return (len(types), [-PIECE_ORDER.index(piece_type) for piece_type in types])
+
+def mirror(sq):
+    return (7 - sq // 8) * 8 + sq % 8
+
+'''
+pieces: list of (piece, square) like ('wQ', 12), square = row * 8 + col
+returns (signature, index) of the position in the table it is stored in
+'''
+def locate(pieces, white_to_move):
+    white = sorted((PIECE_ORDER.index(piece[1]), sq) for piece, sq in pieces if piece[0] == 'w')
+    black = sorted((PIECE_ORDER.index(piece[1]), sq) for piece, sq in pieces if piece[0] == 'b')
+    white_types = [PIECE_ORDER[index] for index, sq in white]
+    black_types = [PIECE_ORDER[index] for index, sq in black]
+    if strength(black_types) > strength(white_types):   # stored with colours swapped and the board upside down
+        white, black = sorted((index, mirror(sq)) for index, sq in black), sorted((index, mirror(sq)) for index, sq in white)
+        white_types, black_types = black_types, white_types
+        white_to_move = not white_to_move
+    signature = ''.join(white_types) + 'v' + ''.join(black_types)
+    index = 0
+    for piece_type, sq in reversed(white + black):
+        index = index * 64 + sq
+    return signature, index * 2 + (0 if white_to_move else 1)
+
+''' the mmap of a table, None if it has not been generated '''
+def get_table(signature, directory=None):
+    if signature not in tables:
+        directory = TABLEBASE_DIR if directory is None else directory
+        path = os.path.join(directory, signature + '.tb')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                tables[signature] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            tables[signature] = False
+    return tables[signature] or None
+
+''' raw table value of a position, None if its table is missing, two bare kings are a draw '''
+def lookup(pieces, white_to_move, directory=None):
+    signature, index = locate(pieces, white_to_move)
+    if signature == 'KvK':
+        return 0
+    if needs_enpassant(signature):
+        return None
+    table = get_table(signature, directory)
+    if table is None:
+        return None
+    return table[index]
+
+''' (WIN / DRAW / LOSS_RESULT, plies to mate) for the side to move, None if gs can't be probed '''
+def probe(gs):
+    if gs.piece_count > MAX_PIECES or gs.enpassant_possible != ():
+        return None
+    if gs.castling_rights:
+        return None
+    pieces = []
+    for row in range(8):
+        for col in range(8):
+            if gs.board[row][col] != '--':
+                pieces.append((gs.board[row][col], row * 8 + col))
+    value = lookup(pieces, gs.whites_turn)
+    if value is None:
+        return None
+    if value == 0:
+        return DRAW, 0
+    if value < LOSS:
+        return WIN, value
+    return LOSS_RESULT, value - LOSS
+
+''' signatures a table's captures and promotions lead to, these are generated before it '''
+def sub_signatures(signature):
+    white, black = split_signature(signature)
+    subs = set()
+    for side, other, is_white in ((white, black, True), (black, white, False)):
+        for i in range(1, len(side)):
+            reduced = side[:i] + side[i + 1:]
+            if side[i] == 'P':
+                for promoted in 'QRBN':
+                    subs.add(normalize(side[:i] + promoted + side[i + 1:], other, is_white))
+            subs.add(normalize(reduced, other, is_white))
+    subs.discard('KvK')
+    return sorted(subs)
+
+def normalize(side, other, is_white):
+    white, black = (side, other) if is_white else (other, side)
+    pieces = [('w' + piece_type, 0) for piece_type in white] + [('b' + piece_type, 0) for piece_type in black]
+    return locate(pieces, True)[0]
+
+''' puts a generated position on gs, which has an otherwise empty board and no castling rights or en passant
+    much cheaper than load_fen, clear_position takes the pieces off again
+'''
+def set_position(gs, pieces, white_to_move):
+    for piece, sq in pieces:
+        gs.board[sq // 8][sq % 8] = piece
+        if piece == 'wK':
+            gs.white_king_location = (sq // 8, sq % 8)
+        elif piece == 'bK':
+            gs.black_king_location = (sq // 8, sq % 8)
+    gs.whites_turn = white_to_move
+    gs.attack_maps = {}     # cached on the zobrist key, which is not kept up to date here
+
+def clear_position(gs, pieces):
+    for piece, sq in pieces:
+        gs.board[sq // 8][sq % 8] = '--'
+
+''' the pieces of table index, None for indices that are not a position (same square twice, pawn on the back rank,
+    identical pieces out of order: only one order is stored)
+'''
+def decode(index, piece_list):
+    white_to_move = index % 2 == 0
+    index //= 2
+    pieces = []
+    used = set()
+    for piece in piece_list:
+        sq = index % 64
+        index //= 64
+        if sq in used or (piece[1] == 'P' and sq // 8 in (0, 7)):
+            return None
+        if pieces and pieces[-1][0] == piece and pieces[-1][1] > sq:
+            return None
+        used.add(sq)
+        pieces.append((piece, sq))
+    return pieces, white_to_move
+
+'''
+generates the table for signature (and first any missing table it depends on), writes directory/signature.tb
+returns the number of won, drawn and lost positions (side to move's point of view)
+'''
+def generate(signature, directory=None, log=print):
+    directory = TABLEBASE_DIR if directory is None else directory
+    signature = normalize(*split_signature(signature), True)
+    if needs_enpassant(signature):
+        raise ValueError('pawns on both sides need en passant, not in the tables: ' + signature)
+    for sub in sub_signatures(signature):
+        if get_table(sub, directory) is None:
+            generate(sub, directory, log)
+    start = time.perf_counter()
+    white, black = split_signature(signature)
+    piece_list = ['w' + piece_type for piece_type in white] + ['b' + piece_type for piece_type in black]
+    size = 2 * 64 ** len(piece_list)
+
+    weights = [2 * 64 ** i for i in range(len(piece_list))]
+    # a quiet move of a piece with no identical piece keeps the table and the piece order: the index is computed directly
+    unique = [piece_list.count(piece) == 1 for piece in piece_list]
+
+    values = bytearray(size)
+    resolved = bytearray(size)
+    counts = bytearray(size)            # moves not yet known to lose, a position is lost when this reaches 0
+    successor_offsets = array('I', [0])
+    successors = array('I')
+    buckets = {}                        # distance -> positions resolved at that distance
+    external = {}                       # distance -> (position, successor is lost) for moves into other tables
+
+    # one pass of move generation, successors in this table are kept, results of the others are scheduled
+    gs = engine.GameState()
+    gs.load_fen('8/8/8/8/8/8/8/8 w - - 0 1')
+    for index in range(size):
+        position = decode(index, piece_list)
+        if position is None:
+            resolved[index] = 1
+            successor_offsets.append(len(successors))
+            continue
+        pieces, white_to_move = position
+        set_position(gs, pieces, white_to_move)
+        enemy_king = gs.black_king_location if white_to_move else gs.white_king_location
+        if gs.square_attacked_by(enemy_king[0], enemy_king[1], 'w' if white_to_move else 'b'):
+            clear_position(gs, pieces)
+            resolved[index] = 1     # side not to move is in check, not a position
+            successor_offsets.append(len(successors))
+            continue
+
+        moves = gs.get_valid_moves()
+        clear_position(gs, pieces)
+        counts[index] = len(moves)
+        if len(moves) == 0:
+            resolved[index] = 1
+            if gs.in_check:         # mated
+                values[index] = LOSS
+                buckets.setdefault(0, []).append(index)
+        for move in moves:
+            from_sq = move.start_row * 8 + move.start_col
+            to_sq = move.end_row * 8 + move.end_col
+            if move.piece_captured == '--' and not move.pawn_promotion:
+                i = next(i for i in range(len(pieces)) if pieces[i][1] == from_sq)
+                if unique[i]:
+                    successors.append((index ^ 1) + (to_sq - from_sq) * weights[i])
+                    continue
+            after = []
+            for piece, sq in pieces:
+                if sq == to_sq:
+                    continue        # captured
+                if sq == from_sq:
+                    after.append((piece[0] + move.promotion_piece if move.pawn_promotion else piece, to_sq))
+                else:
+                    after.append((piece, sq))
+            successor_signature, successor = locate(after, not white_to_move)
+            if successor_signature == signature:
+                successors.append(successor)
+            else:
+                value = lookup(after, not white_to_move, directory)
+                if value is None:
+                    raise ValueError('missing table ' + successor_signature)
+                if value >= LOSS:
+                    external.setdefault(value - LOSS, []).append((index, True))
+                elif value > 0:
+                    external.setdefault(value, []).append((index, False))
+        successor_offsets.append(len(successors))
+
+    # invert the successor lists
+    predecessor_offsets = array('I', [0]) * (size + 1)
+    for successor in successors:
+        predecessor_offsets[successor + 1] += 1
+    for index in range(size):
+        predecessor_offsets[index + 1] += predecessor_offsets[index]
+    predecessors = array('I', [0]) * len(successors)
+    fill = array('I', predecessor_offsets)
+    for index in range(size):
+        for i in range(successor_offsets[index], successor_offsets[index + 1]):
+            successor = successors[i]
+            predecessors[fill[successor]] = index
+            fill[successor] += 1
+    del successors, successor_offsets, fill
+
+    # retrograde: positions resolved at distance d decide their predecessors at d + 1
+    def resolve(index, successor_lost, distance):
+        if resolved[index]:
+            return
+        if successor_lost:
+            values[index] = distance + 1
+        else:
+            counts[index] -= 1
+            if counts[index] > 0:
+                return
+            values[index] = LOSS + distance + 1
+        if distance + 1 >= LOSS:
+            raise ValueError('distance to mate does not fit in the table')
+        resolved[index] = 1
+        buckets.setdefault(distance + 1, []).append(index)
+
+    distance = 0
+    while distance <= max(list(buckets) + list(external), default=-1):
+        for index, successor_lost in external.get(distance, []):
+            resolve(index, successor_lost, distance)
+        for index in buckets.get(distance, []):
+            lost = values[index] >= LOSS
+            for i in range(predecessor_offsets[index], predecessor_offsets[index + 1]):
+                resolve(predecessors[i], lost, distance)
+        distance += 1
+
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, signature + '.tb'), 'wb') as f:
+        f.write(values)
+    tables.pop(signature, None)
+
+    wins = sum(1 for value in values if 0 < value < LOSS)
+    losses = sum(1 for value in values if value >= LOSS)
+    draws = sum(1 for index in range(size) if values[index] == 0 and decode(index, piece_list) is not None)
+    log('{:<8} {:>9} wins {:>9} draws {:>9} losses, longest mate {} plies, {:.1f}s'.format(
+        signature, wins, draws, losses, max(values[index] % LOSS for index in range(size)), time.perf_counter() - start))
+    return wins, draws, losses
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='generate or probe endgame tablebases')
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate_parser = commands.add_parser('generate', help='generate tables (default: all 3 piece tables)')
+    generate_parser.add_argument('signatures', nargs='*', default=THREE_PIECE)
+    generate_parser.add_argument('--dir', default=None, help='default: tablebases next to this file')
+    probe_parser = commands.add_parser('probe', help='result of a position')
+    probe_parser.add_argument('--fen', required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        for signature in args.signatures:
+            if sum(len(side) for side in split_signature(signature)) > MAX_PIECES:
+                parser.error('at most ' + str(MAX_PIECES) + ' pieces: ' + signature)
+            if needs_enpassant(signature):
+                parser.error('pawns on both sides need en passant, not in the tables: ' + signature)
+            generate(signature, args.dir)
+        return 0
+
+    gs = engine.GameState()
+    gs.load_fen(args.fen)
+    result = probe(gs)
+    if result is None:
+        print('not in the tablebases')
+    else:
+        print({WIN: 'win', DRAW: 'draw', LOSS_RESULT: 'loss'}[result[0]] + ('' if result[0] == DRAW else ' in ' + str(result[1]) + ' plies'))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,164 @@
+'''
+Search telemetry
+while a sink is set, every ai.negamax_helper call counts what the search does and writes one JSON record
+(one line) to the sink: nodes, nodes per second, branching factor, cutoffs, time in move generation and
+evaluation, transposition table and tablebase hit rates, for the whole search and for every iteration
+with no sink ai.stats stays None and the search only pays for the `stats is not None` checks
+
+with several workers (parallel.py) nodes include the workers, the other counters only this process
+
+usage
+    telemetry.enable('search.jsonl')        from code, or the Telemetry UCI option, or selfplay.py --telemetry
+    python telemetry.py search.jsonl        averages per depth over a log
+'''
+import argparse
+import datetime
+import json
+import sys
+import threading
+import time
+
+sink = None     # file the records go to, None = telemetry off
+owns_sink = False   # sink was opened here (from a path), so disable closes it
+sink_lock = threading.Lock()
+
+''' counters of one search, each iteration keeps what changed during it '''
+class SearchStats():
+    COUNTERS = ('nodes', 'quiescence_nodes', 'tt_probes', 'tt_hits', 'tt_cutoffs', 'tablebase_probes', 'tablebase_hits',
+                'cutoffs', 'first_move_cutoffs', 'null_moves', 'null_move_cutoffs', 'lmr_researches', 'pvs_researches',
+                'aspiration_researches', 'move_generations', 'evaluations')
+
+    def __init__(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+        self.move_generation_seconds = 0.0
+        self.evaluation_seconds = 0.0
+        self.start = time.perf_counter()
+        self.iterations = []
+        self.last = self.snapshot()
+
+    def snapshot(self):
+        values = {name: getattr(self, name) for name in self.COUNTERS}
+        values['move_generation_seconds'] = self.move_generation_seconds
+        values['evaluation_seconds'] = self.evaluation_seconds
+        values['seconds'] = time.perf_counter() - self.start
+        return values
+
+    ''' an iteration is complete, keep its share of the counters '''
+    def end_iteration(self, depth, score, nodes):
+        self.nodes = nodes
+        now = self.snapshot()
+        iteration = {name: now[name] - self.last[name] for name in now}
+        iteration.update({'depth': depth, 'score': score})
+        previous = self.iterations[-1]['nodes'] if self.iterations else 0
+        iteration['branching_factor'] = round(iteration['nodes'] / previous, 2) if previous else None
+        self.iterations.append(summarize(iteration))
+        self.last = now
+
+    ''' the record of the whole search '''
+    def record(self, gs, move, depth, score, nodes, pv, book=False):
+        self.nodes = nodes
+        totals = summarize(self.snapshot())
+        totals.update({
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'fen': gs.get_fen(),
+            'move': move.get_uci_notation() if move is not None else None,
+            'book': book,
+            'depth': depth,
+            'score': score,
+            'pv': [pv_move.get_uci_notation() for pv_move in pv],
+            # effective branching factor: the depth-th root of the nodes it took to get there
+            'branching_factor': round(nodes ** (1 / depth), 2) if depth > 0 and nodes > 0 else None,
+            'iterations': self.iterations,
+        })
+        return totals
+
+''' rates from the raw counters, times rounded '''
+def summarize(values):
+    values['nps'] = int(values['nodes'] / values['seconds']) if values['seconds'] > 0 else 0
+    values['first_move_cutoff_rate'] = rate(values['first_move_cutoffs'], values['cutoffs'])
+    values['tt_hit_rate'] = rate(values['tt_hits'], values['tt_probes'])
+    values['tablebase_hit_rate'] = rate(values['tablebase_hits'], values['tablebase_probes'])
+    for name in ('seconds', 'move_generation_seconds', 'evaluation_seconds'):
+        values[name] = round(values[name], 6)
+    return values
+
+def rate(count, total):
+    return round(count / total, 4) if total else None
+
+''' start writing records to path (appended) or an open file '''
+def enable(path_or_file):
+    global sink, owns_sink
+    disable()
+    if isinstance(path_or_file, str):
+        sink, owns_sink = open(path_or_file, 'a'), True
+    else:
+        sink, owns_sink = path_or_file, False
+
+def disable():
+    global sink, owns_sink
+    with sink_lock:
+        if sink is not None and owns_sink:
+            sink.close()
+        sink, owns_sink = None, False
+
+''' write one record as a line, the write is flushed so a log can be followed while the engine runs '''
+def emit(record):
+    with sink_lock:
+        if sink is not None:
+            sink.write(json.dumps(record) + '\n')
+            sink.flush()
+
+''' records of a log file, lines that aren't JSON are skipped '''
+def read_records(path):
+    with open(path) as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+''' averages per depth over the records of a log: iterations, nodes, nps, branching factor and the rates '''
+def summary_by_depth(records):
+    depths = {}
+    for record in records:
+        for iteration in record['iterations']:
+            depths.setdefault(iteration['depth'], []).append(iteration)
+    rows = []
+    for depth in sorted(depths):
+        iterations = depths[depth]
+        totals = {name: sum(iteration[name] for iteration in iterations) for name in
+                  ('nodes', 'seconds', 'cutoffs', 'first_move_cutoffs', 'tt_probes', 'tt_hits', 'move_generation_seconds', 'evaluation_seconds')}
+        factors = [iteration['branching_factor'] for iteration in iterations if iteration['branching_factor'] is not None]
+        rows.append({
+            'depth': depth,
+            'iterations': len(iterations),
+            'nodes': totals['nodes'] // len(iterations),
+            'nps': int(totals['nodes'] / totals['seconds']) if totals['seconds'] > 0 else 0,
+            'branching_factor': round(sum(factors) / len(factors), 2) if factors else None,
+            'first_move_cutoff_rate': rate(totals['first_move_cutoffs'], totals['cutoffs']),
+            'tt_hit_rate': rate(totals['tt_hits'], totals['tt_probes']),
+            'move_generation_share': rate(totals['move_generation_seconds'], totals['seconds']),
+            'evaluation_share': rate(totals['evaluation_seconds'], totals['seconds']),
+        })
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='search telemetry summary')
+    parser.add_argument('log', help='JSON lines written by the telemetry sink')
+    args = parser.parse_args(argv)
+
+    records = list(read_records(args.log))
+    searched = [record for record in records if not record['book']]
+    print(str(len(records)) + ' moves, ' + str(len(records) - len(searched)) + ' from the book')
+    print('{:>5} {:>6} {:>10} {:>9} {:>6} {:>8} {:>7} {:>8} {:>6}'.format(
+        'depth', 'iters', 'nodes', 'nps', 'ebf', 'cut1st', 'tt hit', 'movegen', 'eval'))
+    for row in summary_by_depth(searched):
+        print('{:>5} {:>6} {:>10} {:>9} {:>6} {:>8} {:>7} {:>8} {:>6}'.format(*(
+            '-' if row[name] is None else row[name] for name in
+            ('depth', 'iterations', 'nodes', 'nps', 'branching_factor', 'first_move_cutoff_rate', 'tt_hit_rate',
+             'move_generation_share', 'evaluation_share'))))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
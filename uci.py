@@ -0,0 +1,186 @@
+'''
+UCI front end: python uci.py, then talk UCI over stdin / stdout
+the search runs in its own thread, so commands (stop, ponderhit, isready) are read while it thinks
+
+supported: uci, isready, ucinewgame, setoption (Threads, OwnBook, Telemetry), position startpos|fen ... moves ...,
+go depth|nodes|movetime|wtime btime winc binc movestogo|infinite|ponder, stop, ponderhit, quit
+'''
+import sys
+import threading
+
+import ai
+import engine
+import telemetry
+
+NAME = 'Python Chess Engine'
+AUTHOR = 'chaleeuc'
+MOVES_TO_GO = 30        # moves the remaining clock time is shared over when the GUI doesn't say
+MOVE_OVERHEAD = 0.05    # seconds kept back for communication per move
+
+class UciEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.gs = engine.GameState()
+        self.thread = None
+        self.stop = threading.Event()       # ends the search
+        self.release = threading.Event()    # lets an infinite or ponder search send its bestmove (stop or ponderhit)
+        self.ponder = None                  # threading.Event of a ponder search, set at ponderhit
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    ''' handles one command line, returns False on quit '''
+    def command(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        name, args = tokens[0], tokens[1:]
+        if name == 'uci':
+            self.send('id name ' + NAME)
+            self.send('id author ' + AUTHOR)
+            self.send('option name Threads type spin default ' + str(ai.WORKERS) + ' min 1 max 64')
+            self.send('option name OwnBook type check default ' + ('true' if ai.USE_BOOK else 'false'))
+            self.send('option name Telemetry type string default <empty>')
+            self.send('uciok')
+        elif name == 'isready':
+            self.send('readyok')
+        elif name == 'ucinewgame':
+            self.stop_search()
+            ai.transposition_table.clear()
+        elif name == 'setoption':
+            self.set_option(args)
+        elif name == 'position':
+            self.stop_search()
+            self.set_position(args)
+        elif name == 'go':
+            self.stop_search()
+            self.go(args)
+        elif name == 'stop':
+            self.stop_search()
+        elif name == 'ponderhit':
+            self.ponderhit()
+        elif name == 'quit':
+            self.stop_search()
+            return False
+        return True
+
+    def set_option(self, args):
+        if 'name' not in args or 'value' not in args:
+            return
+        option = ' '.join(args[args.index('name') + 1:args.index('value')]).lower()
+        value = ' '.join(args[args.index('value') + 1:])
+        if option == 'threads':
+            ai.WORKERS = max(1, int(value))
+        elif option == 'ownbook':
+            ai.USE_BOOK = value.lower() == 'true'
+        elif option == 'telemetry':     # file the search records are appended to (telemetry.py), empty turns it off
+            if value in ('', '<empty>'):
+                telemetry.disable()
+            else:
+                telemetry.enable(value)
+
+    ''' position startpos|fen <fen> [moves <uci moves>] '''
+    def set_position(self, args):
+        moves = args.index('moves') if 'moves' in args else len(args)
+        if args and args[0] == 'fen':
+            gs = engine.GameState(' '.join(args[1:moves]))
+        else:
+            gs = engine.GameState()
+        for text in args[moves + 1:]:
+            move = next((move for move in gs.get_valid_moves() if move.get_uci_notation() == text), None)
+            if move is None:
+                self.send('info string illegal move ' + text)
+                break
+            gs.make_a_move(move)
+        self.gs = gs
+
+    ''' search time from the go parameters, None for no limit '''
+    def time_limit(self, params):
+        if 'movetime' in params:
+            return max(params['movetime'] / 1000 - MOVE_OVERHEAD, 0.01)
+        clock = params.get('wtime' if self.gs.whites_turn else 'btime')
+        if clock is None:
+            return None
+        increment = params.get('winc' if self.gs.whites_turn else 'binc', 0)
+        seconds = clock / 1000 / params.get('movestogo', MOVES_TO_GO) + increment / 1000 * 0.8
+        return max(min(seconds, clock / 1000 / 2) - MOVE_OVERHEAD, 0.01)
+
+    def go(self, args):
+        params = {}
+        flags = set()
+        i = 0
+        while i < len(args):
+            if args[i] in ('infinite', 'ponder'):
+                flags.add(args[i])
+                i += 1
+            elif i + 1 < len(args) and args[i + 1].lstrip('-').isdigit():
+                params[args[i]] = int(args[i + 1])
+                i += 2
+            else:
+                i += 1
+
+        time_limit = self.time_limit(params)
+        wait = 'infinite' in flags or 'ponder' in flags
+        # think on the opponent's time, the search only starts its time limit when the event is set at ponderhit
+        self.ponder = threading.Event() if 'ponder' in flags else None
+        max_depth = params.get('depth')
+        if max_depth is None and (wait or time_limit is not None or 'nodes' in params):
+            max_depth = ai.MAX_DEPTH
+        self.stop.clear()
+        self.release.clear()
+        self.thread = threading.Thread(target=self.search, args=(max_depth, time_limit, params.get('nodes'), wait, self.ponder), daemon=True)
+        self.thread.start()
+
+    ''' runs in the search thread, sends info lines while searching and bestmove at the end '''
+    def search(self, max_depth, time_limit, node_limit, wait, ponder):
+        valid_moves = self.gs.get_valid_moves()
+        pv = []
+        def info(depth, score, nodes, seconds, line):
+            pv[:] = line
+            mate = ai.mate_in(score)    # mate scores have the plies to the mate in them
+            score_text = 'cp ' + str(score) if mate is None else 'mate ' + str(mate)
+            self.send('info depth {} score {} nodes {} nps {} time {} pv {}'.format(
+                depth, score_text, nodes, int(nodes / seconds) if seconds > 0 else 0, int(seconds * 1000),
+                ' '.join(move.get_uci_notation() for move in line)))
+
+        move = ai.negamax_helper(self.gs, list(valid_moves), max_depth, time_limit, node_limit, stop=self.stop, on_iteration=info, ponder=ponder)
+        if move is None and valid_moves:    # stopped before the first iteration finished
+            move = valid_moves[0]
+        if wait:    # infinite and ponder searches only answer after stop or ponderhit
+            self.release.wait()
+        if move is None:
+            self.send('bestmove 0000')
+        elif len(pv) > 1 and pv[0] == move:
+            self.send('bestmove ' + move.get_uci_notation() + ' ponder ' + pv[1].get_uci_notation())
+        else:
+            self.send('bestmove ' + move.get_uci_notation())
+
+    ''' the predicted move was played: the ponder search goes on as a normal search with the time limit '''
+    def ponderhit(self):
+        if self.ponder is not None:
+            self.ponder.set()   # read by the running search, its time limit starts now
+        self.ponder = None
+        self.release.set()
+
+    ''' stops a running search, its bestmove is sent before this returns '''
+    def stop_search(self):
+        if self.thread is not None:
+            self.stop.set()
+            self.release.set()
+            self.thread.join()
+            self.thread = None
+
+def main():
+    ai.CHECK_EVERY = 256    # look at the stop flag more often, stop has to answer quickly
+    uci = UciEngine()
+    for line in sys.stdin:
+        if not uci.command(line.strip()):
+            break
+    uci.stop_search()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())